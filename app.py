@@ -1,18 +1,33 @@
 from flask import Flask, render_template, request, redirect, session, url_for, send_file, Response
-import requests
+from flask.sessions import SecureCookieSessionInterface
 import os
 from dotenv import load_dotenv
-from gtts import gTTS
-import edge_tts
-from edge_tts import VoicesManager, Communicate
 import asyncio
 import json
 import logging
-from tqdm import tqdm
+import threading
+import uuid
 from markupsafe import Markup
 from datetime import datetime
-from utils.pdf_parser import extract_text_from_pdf
-from models.llm import ask_llm, stream_llm
+from utils.pdf_parser import PdfPages
+from utils.retrieval import INDEX_SUFFIX, build_index, load_index, index_path_for
+from utils.book_store import BookStore
+from utils.result_cache import ResultCache, file_sha256, make_key
+from utils.answer_cache import AnswerCache
+from utils.jobs import JobManager, DONE, FAILED
+from utils.metrics import (CACHE_REQUESTS, PDF_BYTES, PDF_PAGES, TTS_SECONDS, TTS_SEGMENTS,
+                           RequestMetricsMiddleware, registry, span)
+from utils.sse import sse_event
+from utils.storage import StorageManager
+from utils.tts import AudioStream, get_backend, split_segments, synthesize_segments
+from utils.uploads import commit_upload, hash_from_name, spool_upload, stored_name
+from models.llm import ask_llm, stream_llm, ERROR_MESSAGE, GENERATE_OPTIONS
+from models.llm_client import LLMError
+from models.backend_pool import CHAT, NOTES, STUDY_AID, get_pool, model_for
+from models.summarizer import BookSummarizer
+from models.memory import ConversationMemory
+from models.quiz import QuizEngine
+import config
 
 
 # Configure logging
@@ -23,33 +38,426 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
-UPLOAD_FOLDER = 'uploads'
+UPLOAD_FOLDER = config.UPLOAD_FOLDER
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions with (de)serialization timed as request stages"""
+
+    def open_session(self, app, request):
+        with span("session_open"):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with span("session_save"):
+            return super().save_session(app, session, response)
+
+
+app.session_interface = TimedSessionInterface()
+
+# Request counts and latencies for /metrics; PROFILE_REQUESTS=1 enables
+# ?profile=timing (Server-Timing header) and ?profile=cprofile
+app.wsgi_app = RequestMetricsMiddleware(app.wsgi_app, config.PROFILE_DIR if config.PROFILE_REQUESTS else None)
+
+@app.before_request
+def ensure_initialized():
+    # `flask --app app run`, `gunicorn app:app` and friends never call the factory
+    if not initialized:
+        create_app()
+
+@app.before_request
+def label_request_metrics():
+    # Label metrics by route pattern, not the raw path
+    if request.url_rule:
+        request.environ['studymate.endpoint'] = request.url_rule.rule
+
+# Stores, the job queue and the services built on them are created by
+# create_app(), so importing this module opens no database and starts no
+# thread. Servers that load `app` directly get them on the first request.
+initialized = False
+init_lock = threading.Lock()
+book_store = None  # book text, metadata and chat history; the session only carries ids
+result_cache = None  # study aids by (PDF content hash, prompt template, model)
+summarizer = None  # whole-book notes shared by every study aid
+quiz_engine = None  # MCQs and flashcards, a few JSON items per book section
+memory = None  # recent chat turns plus a running summary of older ones
+jobs = None  # PDF extraction and long generations, off the request threads
+storage = None  # disk quotas for uploads, indexes and audio
+
+# Background model warm-up started by create_app(); /ready reports on it
+warmup_job = None
+
+# Recent chat answers per book, so a repeated question is answered at once
+answer_cache = AnswerCache(config.ANSWER_CACHE_SIZE, config.ANSWER_CACHE_SIMILARITY)
+
+# Uploads are stored once per content hash and shared by every user's book
+# entry; this lock keeps reference counting and file removal consistent
+uploads_lock = threading.Lock()
+
+# Generated audio, one file per (book, voice, narration text)
+TTS_FOLDER = os.path.join(app.static_folder, 'tts')
+tts_backend = get_backend(config.TTS_BACKEND, stub_latency=config.TTS_STUB_LATENCY)
+
+# Candidate chunks retrieved per question; the prompt builder keeps what fits
+RETRIEVAL_TOP_K = 24
+
+def get_user_id():
+    """Return the anonymous id that owns this browser's books"""
+    if 'user_id' not in session:
+        session['user_id'] = uuid.uuid4().hex
+    return session['user_id']
+
+# Keys that carried book text and chat history before the book store existed
+LEGACY_SESSION_KEYS = ('book_history', 'pdf_text', 'chat_history', 'pdf_path', 'book_title',
+                       'all_chat_histories')
+
+def import_legacy_session(user_id):
+    """Move books kept in an old session cookie into the book store, then
+    drop the old keys so the cookie shrinks back to a few bytes"""
+    for filename, book in (session.get('book_history') or {}).items():
+        if not isinstance(book, dict) or book_store.get_book(user_id, filename):
+            continue
+        book_store.add_book(user_id, filename, book.get('original_name', filename), book.get('pdf_text', ''),
+                            upload_time=book.get('upload_time'))
+        for message in book.get('chat_history', []):
+            book_store.add_message(user_id, filename, message.get('question', ''), message.get('answer', ''))
+    for key in LEGACY_SESSION_KEYS:
+        session.pop(key, None)
+
 def init_book_history():
-    """Initialize the book history structure in session"""
-    if 'book_history' not in session:
-        session['book_history'] = {}
+    """Initialize the per-user session keys"""
+    user_id = get_user_id()
+    if any(key in session for key in LEGACY_SESSION_KEYS):
+        import_legacy_session(user_id)
     if 'current_book' not in session:
         session['current_book'] = None
 
 def get_current_book_data():
     """Helper to get current book data with validation"""
-    if 'current_book' not in session or 'book_history' not in session:
+    if not session.get('current_book') or 'user_id' not in session:
         return None
-    return session['book_history'].get(session['current_book'])
+    book_data = book_store.get_book(session['user_id'], session['current_book'])
+    if book_data and book_data['status'] == 'evicted':
+        book_data = restore_text(session['user_id'], book_data)
+    return book_data
+
+def get_content_hash(user_id, book_data):
+    """SHA-256 of the book's PDF, computed once for books stored before hashing existed"""
+    if book_data.get('content_hash'):
+        return book_data['content_hash']
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], book_data['filename'])
+    if os.path.exists(filepath):
+        content_hash = file_sha256(filepath)
+    else:
+        content_hash = make_key(book_store.get_text(user_id, book_data['filename']))
+    book_store.set_content_hash(user_id, book_data['filename'], content_hash)
+    book_data['content_hash'] = content_hash
+    return content_hash
+
+def answer_cache_key(book_hash):
+    return make_key(book_hash, model_for(CHAT))
+
+def cached_answer(user_id, book_data, question):
+    """Stored answer to `question` (or a near-identical one) for this book, or None"""
+    answer = answer_cache.get(answer_cache_key(get_content_hash(user_id, book_data)), question)
+    CACHE_REQUESTS.inc(cache="answers", result="miss" if answer is None else "hit")
+    return answer
+
+def remember_answer(user_id, book_data, question, answer):
+    """Cache a complete answer (callers skip answers whose stream failed)"""
+    if answer == ERROR_MESSAGE:
+        return
+    answer_cache.put(answer_cache_key(get_content_hash(user_id, book_data)), question, answer)
+
+def study_aid_key(user_id, book_data, prompt_template):
+    # 'book-notes': generated from whole-book notes rather than the opening pages
+    return make_key(get_content_hash(user_id, book_data), prompt_template, model_for(STUDY_AID), 'book-notes',
+                    model_for(NOTES))
+
+def ask_study_aid(prompt_template, book_data, user_id, regenerate=False, progress=None):
+    """ask_llm over notes covering the whole book, reusing a stored result for identical PDFs.
+
+    `prompt_template` may contain `{title}`. With `regenerate` the cached entry
+    is ignored and refreshed (the book notes it is built from are reused).
+    `progress(done, total, message)` reports the notes being built.
+    """
+    key = study_aid_key(user_id, book_data, prompt_template)
+    if not regenerate:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        notes = summarizer.notes(book_store.get_pages(user_id, book_data['filename']),
+                                 book_data['original_name'], progress)
+    except LLMError as e:
+        logging.warning("Building book notes failed: %s", e)
+        return ERROR_MESSAGE
+
+    # Identical requests already generating (e.g. a class opening the same
+    # textbook) join that generation; the finished result lands in the cache
+    return ask_llm(
+        prompt_template.replace('{title}', book_data['original_name']),
+        notes,
+        book_data['original_name'],
+        cache=result_cache,
+        cache_key=key,
+        job=STUDY_AID
+    )
+
+def study_aid_job(job, prompt_template, book_data, user_id, regenerate=False):
+    job.update(message="Reading the book")
+
+    def progress(done, total, message):
+        job.update(0.9 * done / total, message)
+
+    return ask_study_aid(prompt_template, book_data, user_id, regenerate, progress)
+
+def get_study_aid(prompt_template, book_data):
+    """Return (result, None) if the study aid is ready, else (None, job) generating it.
+
+    `?job=<id>` picks up the result of a finished job and `?regenerate=1`
+    bypasses the cache.
+    """
+    user_id = get_user_id()
+    key = study_aid_key(user_id, book_data, prompt_template)
+    # Only a job for this study aid of this book; any other falls through
+    job = jobs.get(request.args.get('job', ''))
+    if job and job.key == f"study_aid:{key}" and job.status == DONE:
+        return job.result, None
+
+    regenerate = request.args.get('regenerate') == '1'
+    if not regenerate:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached, None
+
+    job = jobs.submit('study_aid', study_aid_job, prompt_template, book_data, user_id, regenerate,
+                      key=f"study_aid:{key}")
+    return None, job
+
+def quiz_key(user_id, book_data, kind):
+    return make_key(get_content_hash(user_id, book_data), 'quiz', kind, str(config.QUIZ_SIZE),
+                    model_for(STUDY_AID))
+
+def quiz_job(job, kind, book_data, user_id, regenerate=False):
+    """Job: generate a quiz and cache it if complete"""
+    job.update(message="Reading the book")
+
+    def progress(done, total, message):
+        job.update(done / total, message)
+
+    items = quiz_engine.generate(kind, book_store.get_pages(user_id, book_data['filename']),
+                                 book_data['original_name'], config.QUIZ_SIZE, progress, fresh=regenerate)
+    if len(items) == config.QUIZ_SIZE:
+        result_cache.set(quiz_key(user_id, book_data, kind), json.dumps(items))
+    return items
+
+def get_quiz(kind, book_data):
+    """Like get_study_aid, for the structured items of a quiz ("mcq" or "flashcards")"""
+    user_id = get_user_id()
+    key = quiz_key(user_id, book_data, kind)
+    job = jobs.get(request.args.get('job', ''))
+    if job and job.key == f"quiz:{key}" and job.status == DONE:
+        return job.result, None
+
+    regenerate = request.args.get('regenerate') == '1'
+    if not regenerate:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return json.loads(cached), None
+
+    job = jobs.submit('quiz', quiz_job, kind, book_data, user_id, regenerate, key=f"quiz:{key}")
+    return None, job
+
+def render_job_loading(job, heading):
+    """Loading page that polls the job and reloads the route once it finishes"""
+    return render_template('job_loading.html',
+                           job_id=job.id,
+                           heading=heading,
+                           next_url=url_for(request.endpoint, job=job.id))
+
+def process_upload(job, filename, filepath):
+    """Job: hash, extract and index an uploaded PDF for every book waiting on it"""
+    content_hash = hash_from_name(filename)
+    if content_hash is None:
+        job.update(0.05, "Hashing PDF")
+        content_hash = file_sha256(filepath)
+    job.update(0.2, "Extracting text")
+    try:
+        pages, page_count = extract_and_index(filepath, job)
+    except Exception:
+        book_store.finish_book(filename, "", content_hash, status='failed')
+        raise
+    page_ends, offset = [], 0
+    for text in pages:
+        offset += len(text)
+        page_ends.append(offset)
+    book_store.finish_book(filename, "".join(pages), content_hash, page_ends=page_ends, page_count=page_count)
+    return filename
+
+def reuse_processed_book(user_id, filename):
+    """Skip extraction when another copy of this PDF is already processed.
+
+    True if the book is ready: its text was copied from that copy and the
+    shared index next to the upload exists.
+    """
+    content_hash = hash_from_name(filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if content_hash is None or not os.path.exists(index_path_for(filepath)):
+        return False
+    return book_store.use_stored_text(user_id, filename, content_hash)
+
+def restore_text(user_id, book_data):
+    """Extract a book's text again after it was evicted to save space.
+
+    Without its PDF the book cannot be read any more and is marked failed.
+    """
+    filename = book_data['filename']
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    with uploads_lock:
+        # Under the lock, so the PDF is not evicted while the books wait for it
+        if os.path.exists(filepath):
+            book_store.reprocess(filename)
+            storage.touch(filepath)
+            found = True
+        else:
+            book_store.set_status(user_id, filename, 'failed')
+            found = False
+    if found:
+        start_processing(filename)
+    return book_store.get_book(user_id, filename)
+
+def open_book(user_id, filename, original_name, upload_time=None, partial_path=None):
+    """Add an uploaded file to a user's books unless it is already there, and
+    make sure its text is available (copied or extracted in the background).
+
+    `partial_path` is a freshly spooled upload to move into place first.
+    """
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    with uploads_lock:
+        if partial_path:
+            commit_upload(partial_path, filepath)
+        storage.record(filepath, 'uploads')
+        book_data = book_store.get_book(user_id, filename)
+        is_new = book_data is None or book_data['status'] == 'failed'
+        if is_new:
+            book_store.add_book(user_id, filename, original_name, upload_time=upload_time,
+                                content_hash=hash_from_name(filename), status='processing')
+    if is_new and not reuse_processed_book(user_id, filename):
+        start_processing(filename)
+    book_store.touch(user_id, filename)
+
+def release_upload(filename):
+    """Delete an upload and its index once no book references it (call with uploads_lock held)"""
+    if book_store.count_references(filename):
+        return
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    for path in (filepath, index_path_for(filepath)):
+        if os.path.exists(path):
+            os.remove(path)
+    storage.forget(filepath, index_path_for(filepath))
+    content_hash = hash_from_name(filename)
+    if content_hash:
+        answer_cache.invalidate(answer_cache_key(content_hash))
+
+def evict_upload(filepath):
+    """Storage eviction: remove an uploaded PDF unless it is still being extracted.
+
+    Books made from it keep their stored pages and chats; their index is
+    rebuilt from those pages when needed.
+    """
+    filename = os.path.basename(filepath)
+    with uploads_lock:
+        if book_store.count_references(filename, status='processing'):
+            return False
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    return True
 
+def start_processing(filename):
+    """Queue extraction for an upload, or return the job already doing it.
 
-# Add this helper function at the top
-def init_session():
-    """Initialize or reset session variables"""
-    session['pdf_path'] = None
-    session['book_title'] = None
-    session['pdf_text'] = ""
-    session['chat_history'] = []
-    session['recent_books'] = session.get('recent_books', [])
-    session['all_chat_histories'] = session.get('all_chat_histories', {})
+    The job is shared by every user waiting on the same file, so it has no owner.
+    """
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    return jobs.submit('extract', process_upload, filename, filepath, key=f"extract:{filename}")
+
+def extract_and_index(filepath, job=None):
+    """Extract a PDF's page texts and build its retrieval index next to the upload.
+
+    Returns (page texts, pages in the PDF); past PDF_MAX_PAGES the second is larger.
+    """
+    pdf = PdfPages(filepath, config.PDF_MAX_PAGES, config.PDF_WORKERS)
+    pages = []
+    with span("pdf_extract"):
+        for record in pdf:
+            pages.append(record['text'])
+            PDF_PAGES.inc()
+            PDF_BYTES.inc(len(record['text'].encode('utf-8')))
+            if job:
+                job.update(0.2 + 0.7 * record['page'] / pdf.pages_to_extract,
+                           f"Extracted page {record['page']} of {pdf.pages_to_extract}")
+    if pdf.truncated:
+        logging.warning("%s has %d pages; only the first %d were extracted",
+                        filepath, pdf.page_count, pdf.pages_to_extract)
+    with span("index_build"):
+        build_index(filepath, pages)
+    storage.record(index_path_for(filepath), 'indexes')
+    return pages, pdf.page_count
+
+def rebuild_index(user_id, filename, filepath):
+    """Index a book again from its stored pages (or its PDF), or None if neither is there"""
+    pages = book_store.get_pages(user_id, filename)
+    if pages:
+        with span("index_build"):
+            build_index(filepath, pages)
+        storage.record(index_path_for(filepath), 'indexes')
+    elif os.path.exists(filepath):
+        extract_and_index(filepath)
+    return load_index(filepath)
+
+def get_book_context(user_id, book_data, question):
+    """Return the book chunks most relevant to `question`, best first"""
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], book_data['filename'])
+    index = load_index(filepath)
+    if index is None:
+        # Evicted to save space, or the book predates indexing
+        index = rebuild_index(user_id, book_data['filename'], filepath)
+    storage.touch(filepath, index_path_for(filepath))
+
+    if index is None:
+        # No PDF to index; the prompt builder trims the plain text instead
+        return book_store.get_text(user_id, book_data['filename'])
+    with span("retrieval"):
+        return index.ranked_chunks(question, RETRIEVAL_TOP_K)
+
+def get_chat_inputs(user_id, book_data, question):
+    """(book context, recent history, summary of older history) for a chat
+    question; shared by every chat path"""
+    with span("history_load"):
+        history, summary = memory.recall(user_id, book_data['filename'])
+    return get_book_context(user_id, book_data, question), history, summary
+
+def fold_memory(job, user_id, filename, title):
+    memory.fold(user_id, filename, title)
+
+def save_exchange(user_id, book_data, question, answer):
+    """Store a chat exchange; older turns are then folded into the running summary in the background"""
+    with span("store_write"):
+        book_store.add_message(user_id, book_data['filename'], question, answer)
+        needs_fold = memory.needs_fold(user_id, book_data['filename'])
+    if needs_fold:
+        jobs.submit('memory', fold_memory, user_id, book_data['filename'], book_data['original_name'],
+                    key=f"memory:{user_id}:{book_data['filename']}")
+
+def chat_page(user_id, filename, before_id=None):
+    """(up to CHAT_PAGE_SIZE messages before `before_id`, whether earlier ones exist)"""
+    messages = book_store.get_chat_history(user_id, filename, limit=config.CHAT_PAGE_SIZE + 1,
+                                           before_id=before_id)
+    return messages[-config.CHAT_PAGE_SIZE:], len(messages) > config.CHAT_PAGE_SIZE
 
 # add a session variable to track recent books
 def add_to_recent_books(title):
@@ -69,33 +477,21 @@ def index():
     if request.method == 'POST':
         file = request.files['pdf']
         if file and file.filename.endswith('.pdf'):
-            # Create unique filename
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}_{file.filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Extract text immediately
-            pdf_text = extract_text_from_pdf(filepath)
-            
-            # Initialize book data
-            book_data = {
-                'filename': filename,
-                'original_name': file.filename,
-                'upload_time': timestamp,
-                'last_accessed': timestamp,
-                'pdf_text': pdf_text,
-                'chat_history': []
-            }
+            # Hash while streaming to disk; the file is stored once under its
+            # content hash however many users upload it
+            content_hash, partial_path = spool_upload(file.stream, app.config['UPLOAD_FOLDER'])
+            filename = stored_name(content_hash)
             
-            # Store in session
-            session['book_history'][filename] = book_data
+            # Store server-side, keep only the book id in the session.
+            # A PDF that was processed before is ready at once; otherwise
+            # extraction runs in the background and the chat page shows progress.
+            open_book(get_user_id(), filename, file.filename, upload_time=timestamp, partial_path=partial_path)
             session['current_book'] = filename
-            session.modified = True
             
             return redirect(url_for('chat'))
 
-    return render_template('index.html', book_history=session.get('book_history', {}))
+    return render_template('index.html', book_history=book_store.list_books(get_user_id()))
 
 # Updated chat route
 @app.route('/chat', methods=['GET', 'POST'])
@@ -106,43 +502,42 @@ def chat():
     if not book_data:
         return redirect(url_for('index'))
     
-    if request.method == 'POST':
+    user_id = get_user_id()
+    processing_job = None
+    if book_data['status'] == 'processing':
+        processing_job = start_processing(book_data['filename'])
+    elif request.method == 'POST' and book_data['status'] == 'ready':
         user_question = request.form.get('question')
         if user_question:
-            # Get full history for this book (last 4 messages)
-            full_history = book_data.get("chat_history", [])
-            combined_history = ""
-            for message in full_history[-4:]:
-                combined_history += f"Question: {message['question']}\nAnswer: {message['answer']}\n"
-
-            # Combine chat history + current PDF content (limit total)
-            full_context = f"{combined_history.strip()}\n\n{book_data['pdf_text'].strip()}"
-            context = full_context[:3500]  # Optional: Clean slicing if needed
-
-            # Ask the LLM with memory + pdf content
-            answer = ask_llm(
-                user_question, 
-                context,  # Changed from session['pdf_text']
-                book_data['original_name']
-            )
+            answer = cached_answer(user_id, book_data, user_question)
+            if answer is None:
+                # Recent history + the most relevant book pages; the prompt
+                # builder fits both into the model's context window
+                book_context, history, summary = get_chat_inputs(user_id, book_data, user_question)
+
+                # Ask the LLM with memory + pdf content
+                answer = ask_llm(
+                    user_question, 
+                    book_context,
+                    book_data['original_name'],
+                    history,
+                    summary=summary
+                )
+                remember_answer(user_id, book_data, user_question, answer)
             
             # Save the current exchange to book's chat history
-            book_data['chat_history'].append({
-                'question': user_question,
-                'answer': answer
-            })
-            
-            # Update session
-            session['book_history'][session['current_book']] = book_data
-            session.modified = True
+            save_exchange(user_id, book_data, user_question, answer)
     
-    return render_template('chat.html',
-                         chat_history=book_data['chat_history'],
-                         book_history=session['book_history'],
-                         current_book=session['current_book'],
-                         current_book_data=book_data)
-
-from flask import Response
+    # Only the latest messages are rendered; earlier ones load on demand
+    chat_history, has_earlier = chat_page(user_id, book_data['filename'])
+    with span("render"):
+        return render_template('chat.html',
+                             chat_history=chat_history,
+                             has_earlier=has_earlier,
+                             book_history=book_store.list_books(user_id),
+                             current_book=session['current_book'],
+                             current_book_data=book_data,
+                             processing_job=processing_job)
 
 @app.route('/stream_chat', methods=['POST'])
 def stream_chat():
@@ -151,34 +546,56 @@ def stream_chat():
 
     if not user_question or not book_data:
         return "Invalid data", 400
+    if book_data['status'] != 'ready':
+        return "Book is still being processed", 409
 
-    # Build context with last 4 interactions
-    history = ""
-    for chat in book_data.get("chat_history", [])[-4:]:
-        history += f"Q: {chat['question']}\nA: {chat['answer']}\n"
-    full_context = f"{history}\n\n{book_data['pdf_text']}"[:3500]
+    user_id = get_user_id()
+
+    cached = cached_answer(user_id, book_data, user_question)
+    if cached is None:
+        # Same context as /chat, so both paths send the same prompt
+        book_context, history, summary = get_chat_inputs(user_id, book_data, user_question)
 
     def generate():
         buffer = ""
-        for chunk in stream_llm(user_question, full_context, book_data["original_name"]):
-            buffer += chunk
-            yield chunk
-        # Save to session when stream finishes
-        book_data['chat_history'].append({
-            'question': user_question,
-            'answer': buffer
-        })
-        session['book_history'][session['current_book']] = book_data
-        session.modified = True
-
-    return Response(generate(), content_type='text/plain')
+        if cached is not None:
+            buffer = cached
+            yield sse_event(cached)
+        else:
+            errors = []
+            for chunk in stream_llm(user_question, book_context, book_data["original_name"], history,
+                                    summary=summary, errors=errors):
+                if chunk:
+                    buffer += chunk
+                    yield sse_event(chunk)
+            if not errors:
+                remember_answer(user_id, book_data, user_question, buffer)
+        # Save to the book store when stream finishes (the session cookie
+        # has already been sent by now)
+        save_exchange(user_id, book_data, user_question, buffer)
+        yield sse_event({}, event='done')
+
+    # Served by Flask when running under plain WSGI; asgi.py replaces this
+    # route with a non-blocking implementation
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/chat_history')
+def chat_history():
+    """A page of earlier messages for the current book, oldest first"""
+    book_data = get_current_book_data()
+    if not book_data:
+        return {"error": "No book selected"}, 400
+    before_id = request.args.get('before', type=int)
+    messages, has_earlier = chat_page(get_user_id(), book_data['filename'], before_id)
+    return {"messages": messages, "has_earlier": has_earlier}
 
 
 @app.route('/delete_book/<filename>', methods=['GET', 'POST'])
 def delete_book(filename):
     if request.method == 'GET':
         # Show confirmation page
-        book_data = session['book_history'].get(filename)
+        book_data = book_store.get_book(get_user_id(), filename)
         if not book_data:
             return "Book not found", 404
         return render_template('confirm_delete.html', 
@@ -187,25 +604,18 @@ def delete_book(filename):
     
     # Handle POST request (actual deletion)
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Delete physical file if exists
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        # Clean up from session data
-        if 'book_history' in session and filename in session['book_history']:
-            # If deleting current book, redirect to index
-            if session.get('current_book') == filename:
-                session.pop('current_book', None)
-            
-            # Remove from book history
-            del session['book_history'][filename]
-            
-            # Remove from recent books if exists
-            if 'recent_books' in session and filename in session['recent_books']:
-                session['recent_books'].remove(filename)
-            
+        # Remove this user's book; the file and its index go with the last reference
+        with uploads_lock:
+            book_store.delete_book(get_user_id(), filename)
+            release_upload(filename)
+
+        # If deleting current book, redirect to index
+        if session.get('current_book') == filename:
+            session.pop('current_book', None)
+
+        # Remove from recent books if exists
+        if 'recent_books' in session and filename in session['recent_books']:
+            session['recent_books'].remove(filename)
             session.modified = True
             
         return redirect(url_for('index'))
@@ -215,9 +625,7 @@ def delete_book(filename):
 
 @app.route('/clear_chat/<filename>')
 def clear_chat(filename):
-    if 'book_history' in session and filename in session['book_history']:
-        session['book_history'][filename]['chat_history'] = []
-        session.modified = True
+    book_store.clear_chat(get_user_id(), filename)
     return redirect(url_for('chat'))
 
 
@@ -227,24 +635,15 @@ def clear_chat(filename):
 def load_book(filename):
     init_book_history()
     
+    user_id = get_user_id()
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(filepath):
-        # If book not in history, add it
-        if filename not in session['book_history']:
-            pdf_text = extract_text_from_pdf(filepath)
-            session['book_history'][filename] = {
-                'filename': filename,
-                'original_name': filename,
-                'upload_time': datetime.now().strftime("%Y%m%d_%H%M%S"),
-                'last_accessed': datetime.now().strftime("%Y%m%d_%H%M%S"),
-                'pdf_text': pdf_text,
-                'chat_history': []
-            }
-        
-        # Update last accessed time and set as current
-        session['book_history'][filename]['last_accessed'] = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Only PDFs; the uploads folder also holds indexes and partial uploads.
+    # A book already stored stays readable after its PDF was evicted.
+    if filename.endswith('.pdf') and (os.path.exists(filepath) or book_store.get_book(user_id, filename)):
+        # If book not in history, add it (reusing extracted text when possible)
+        # and update its last accessed time
+        open_book(user_id, filename, filename)
         session['current_book'] = filename
-        session.modified = True
         
         return redirect(url_for('chat'))
     return "Book not found", 404
@@ -257,135 +656,218 @@ def switch_book(title):
     return redirect("/chat")  # Or whatever your chat route is
 
 
+SUMMARY_PROMPT = "Summarize the book '{title}' in a few key points."
+
+TTS_SUMMARY_PROMPT = (
+    """Do not use Markdown or code blocks. Just new lines and plain text. Summarize this PDF in plain language like a human tutor would explain. 
+        No markdowns, symbols like < or >, no code blocks, just clean spoken explanation text."""
+)
+
+def get_ready_book():
+    """Current book if its text has been extracted, else None"""
+    book_data = get_current_book_data()
+    if not book_data or book_data['status'] != 'ready':
+        return None
+    return book_data
+
 @app.route('/mcq') #Verified
 def mcq():
-    book_data = get_current_book_data()
-    questions = ask_llm("""
-    You are an expert in creating multiple choice questions.
-    NOTE : Create 10 important useful career and knowledge based on ${book_title} and understand with Context of ${book_title}and generate 10 important useful career and knowledge based multiple choice questions with 4 options each and final correct answer must be at last for all attempted answers !! as exact same as like
-    I NEED EXACT FORMAT FOR EVERY REQUEST !!!
-    Create 10 important useful career and knowledge based multiple choice questions with 4 options each andn final correct answer must be atlast for all attempted answers !! as exact same as like
-    EXACT NOTE : Only use the Exact Format for every Request !!:
-    
-    <h3><bold>1.</bold> What is the ultimate GNU/Linux learning guide discussed in this document?</h3>
-    For options, use list tag and mention options A, B, C, D.
-    <br>
-    <h3><bold>2.</bold> Which book is recommended for mastering the Linux command line?</h3>
-    2nd question options and so on upto 10 questions with options A, B, C, D for each question.
-    ....
-    ....
-    <h2>Answers:</h2>
-    <br>
-    1. A (according to solution of that question)<br>
-    2. D (according to solution of that question)<br>
-    3. B (according to solution of that question)<br>
-    ...
-    """, book_data['pdf_text'], book_data['original_name'])
+    book_data = get_ready_book()
+    if not book_data:
+        return redirect(url_for('chat'))
+
+    questions, job = get_quiz('mcq', book_data)
+    if job:
+        return render_job_loading(job, "🧪 Generating MCQs")
     return render_template('mcq.html', questions=questions, title=book_data['original_name'])
 
 @app.route('/summarize')
 def summarize():
-    book_data = get_current_book_data()
+    book_data = get_ready_book()
     if not book_data:
-        return redirect(url_for('index'))
+        return redirect(url_for('chat'))
     
-    summary = ask_llm(
-        f"Summarize the book '{book_data['original_name']}' in a few key points.", 
-        book_data['pdf_text'],  # Changed from session['pdf_text']
-        book_data['original_name']
-    )
+    summary, job = get_study_aid(SUMMARY_PROMPT, book_data)
+    if job:
+        return render_job_loading(job, "🧠 Summarizing")
     return render_template('summary.html', summary=summary, title=book_data['original_name'])
 
 @app.route('/flashcards')
 def flashcards():
-    book_data = get_current_book_data()
+    book_data = get_ready_book()
     if not book_data:
-        return redirect(url_for('index'))
+        return redirect(url_for('chat'))
     
-    cards = ask_llm(
-        "Extract 10 key concepts or definitions from this PDF as flashcards (term + explanation)",
-        book_data['pdf_text'],  # Changed from session['pdf_text']
-        book_data['original_name']
-    )
+    cards, job = get_quiz('flashcards', book_data)
+    if job:
+        return render_job_loading(job, "🗂️ Creating Flashcards")
     return render_template('flashcards.html', cards=cards, title=book_data['original_name'])
 
-@app.route('/tts', methods=['GET', 'POST'])
-def tts_entrypoint():
-    return render_template("tts_loading.html")  # show loader first
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job or (job.owner and job.owner != session.get('user_id')):
+        return {"error": "Job not found"}, 404
+    return job.to_dict()
+
+def tts_output_path(book_data, user_id, selected_voice, summary):
+    """Audio file for this book + voice + narration text, shared across users and jobs"""
+    key = make_key(get_content_hash(user_id, book_data), selected_voice, summary)
+    return os.path.join(TTS_FOLDER, f"{key}.mp3")
+
+def tts_job(job, book_data, user_id, selected_voice):
+    """Job: write a spoken summary of the book and synthesize it to MP3"""
+    job.update(0.05, "Writing the narration")
+
+    def progress(done, total, message):
+        job.update(0.05 + 0.2 * done / total, message)
+
+    summary = ask_study_aid(TTS_SUMMARY_PROMPT, book_data, user_id, progress=progress)
+    if summary == ERROR_MESSAGE:
+        # Fail the job rather than narrate (and cache) the error message
+        raise LLMError("Writing the narration failed")
+    output_path = tts_output_path(book_data, user_id, selected_voice, summary)
+    audio_file = os.path.relpath(output_path, app.static_folder).replace(os.sep, '/')
+    result = {"summary": summary, "audio_file": audio_file, "voice": selected_voice}
+    if os.path.exists(output_path):
+        CACHE_REQUESTS.inc(cache="tts_audio", result="hit")
+        storage.touch(output_path)
+        return result
+    CACHE_REQUESTS.inc(cache="tts_audio", result="miss")
+
+    # Segments are synthesized concurrently and published in order, so
+    # listeners on /tts_stream can start playing after the first one.
+    segments = split_segments(summary, config.TTS_SEGMENT_CHARS)
+    audio = AudioStream()
+    job.meta.update(summary=summary, voice=selected_voice, audio=audio)
+    job.update(0.3, "Synthesizing audio")
+    os.makedirs(TTS_FOLDER, exist_ok=True)
+    partial_path = f"{output_path}.{job.id}.part"
 
+    async def generate_audio():
+        with open(partial_path, "wb") as f:
+            async for index, data in synthesize_segments(segments, selected_voice, tts_backend,
+                                                         config.TTS_CONCURRENCY):
+                f.write(data)
+                audio.append(data)
+                job.update(0.3 + 0.7 * (index + 1) / len(segments),
+                           f"Synthesized {index + 1} of {len(segments)} sentences")
 
-@app.route('/tts_ready', methods=['GET', 'POST'])
-def tts_ready():
-    from app import ask_llm
-    book_data = get_current_book_data()
+    try:
+        with TTS_SECONDS.time(backend=config.TTS_BACKEND):
+            asyncio.run(generate_audio())
+        TTS_SEGMENTS.inc(len(segments), backend=config.TTS_BACKEND)
+        os.replace(partial_path, output_path)
+        storage.record(output_path, 'audio')
+    finally:
+        audio.finish()
+        # Once the file is written /tts_stream redirects to it; listeners
+        # already streaming keep their own reference until they finish
+        job.meta.pop('audio', None)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    return result
+
+@app.route('/tts', methods=['GET', 'POST'])
+def tts_entrypoint():
+    book_data = get_ready_book()
     if not book_data:
-        return redirect(url_for('index'))
+        return redirect(url_for('chat'))
 
+    user_id = get_user_id()
     selected_voice = request.form.get("voice") or "en-US-AriaNeural"
-    output_path = os.path.join("static", "summary.mp3")
-    progress_file = os.path.join("static", "tts_progress.txt")
+    job = jobs.submit('tts', tts_job, book_data, user_id, selected_voice,
+                      key=f"tts:{user_id}:{book_data['filename']}:{selected_voice}", owner=user_id)
+    return render_template("tts_loading.html", job_id=job.id)  # show loader first
 
-    if os.path.exists(output_path):
-        os.remove(output_path)
-
-    with open(progress_file, 'w') as f:
-        f.write("0")  # Start progress
-
-    summary_prompt = (
-        """Do not use Markdown or code blocks. Just new lines and plain text. Summarize this PDF in plain language like a human tutor would explain. 
-        No markdowns, symbols like < or >, no code blocks, just clean spoken explanation text."""
-    )
 
-    summary = ask_llm(summary_prompt, book_data["pdf_text"], book_data["original_name"])
-
-    async def generate_audio():
-        communicate = edge_tts.Communicate(text=summary, voice=selected_voice)
-        total = 100
-        written = 0
-        chunk_count = 0
-        with open(output_path, "wb") as f:
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    f.write(chunk["data"])
-                    chunk_count += 1
-                    # Simulate progress increment
-                    written = min(100, int((chunk_count / 40) * 100))
-                    with open(progress_file, 'w') as pf:
-                        pf.write(str(written))
-
-    asyncio.run(generate_audio())
-
-    with open(progress_file, 'w') as pf:
-        pf.write("100")
-
-    return render_template("tts.html", audio_file="summary.mp3", summary=summary, selected_voice=selected_voice)
+@app.route('/tts_ready')
+def tts_ready():
+    job = jobs.get(request.args.get('job', ''))
+    if not job or job.kind != 'tts' or job.owner != session.get('user_id'):
+        return redirect(url_for('tts_entrypoint'))
+    if job.status == FAILED:
+        return render_template("tts_error.html")
+    if not job.finished:
+        if 'audio' not in job.meta or not job.meta['audio'].ready_segments:
+            return render_template("tts_loading.html", job_id=job.id)
+        # Play while the rest is still being synthesized
+        return render_template("tts.html", audio_url=url_for('tts_stream', job=job.id),
+                               summary=job.meta['summary'], selected_voice=job.meta['voice'])
+
+    result = job.result
+    return render_template("tts.html", audio_url=url_for('static', filename=result["audio_file"]),
+                           summary=result["summary"], selected_voice=result["voice"])
+
+@app.route('/tts_stream')
+def tts_stream():
+    """Chunked MP3 of a running TTS job, sent segment by segment as it is synthesized"""
+    job = jobs.get(request.args.get('job', ''))
+    if not job or job.kind != 'tts' or job.owner != session.get('user_id'):
+        return "Audio not found", 404
+    if job.status == DONE:
+        return redirect(url_for('static', filename=job.result["audio_file"]))
+    if 'audio' not in job.meta:
+        return "Audio not ready", 409
+    return Response(iter(job.meta['audio']), mimetype='audio/mpeg',
+                    headers={'Cache-Control': 'no-store'})
 
 @app.route('/tts_status')
 def tts_status():
-    progress_file = "static/tts_progress.txt"
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r') as f:
-            percent = f.read().strip()
-            return {"progress": int(percent)}
-    return {"progress": 0}
+    job = jobs.get(request.args.get('job', ''))
+    if not job or job.kind != 'tts' or job.owner != session.get('user_id'):
+        return {"progress": 0, "status": "missing"}, 404
+    audio = job.meta.get('audio')
+    return {"progress": round(job.progress * 100), "status": job.status, "message": job.message,
+            "playable": bool(audio and audio.ready_segments)}
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this process's counters and histograms"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 503 until the model warm-up has finished"""
+    if warmup_job is None:
+        return {'status': 'ready', 'warmup': 'off'}
+    if warmup_job.status == DONE:
+        return {'status': 'ready', 'warmup': 'done', 'backends': warmup_job.result}
+    if warmup_job.status == FAILED:
+        return {'status': 'failed', 'warmup': 'failed', 'error': warmup_job.error}, 503
+    return {'status': 'starting', 'warmup': warmup_job.status}, 503
+
+@app.route('/storage')
+def storage_usage():
+    """Disk use per storage category against its quota, plus the databases"""
+    databases = {}
+    for name, path in (('books', config.BOOK_STORE_PATH), ('results', config.RESULT_CACHE_PATH),
+                       ('storage', config.STORAGE_INDEX_PATH)):
+        databases[name] = sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+    categories = storage.usage()
+    categories['texts'] = book_store.text_usage()
+    return {'categories': categories, 'databases': databases}
 
 
 @app.route('/cleanup_books', methods=['POST'])
 def cleanup_books():
-    """Clean up books that don't exist in uploads folder"""
+    """Clean up books whose upload no longer exists and whose text was never stored"""
     try:
-        existing_files = set(os.listdir(app.config['UPLOAD_FOLDER']))
+        user_id = get_user_id()
         books_to_remove = []
         
-        # Find books that don't exist in uploads folder
-        for filename, book_data in session.get('book_history', {}).items():
-            if filename not in existing_files:
+        # Check this user's books only, not the whole uploads folder. Ready
+        # books work without their PDF (it may have been evicted for space).
+        for filename, book in book_store.list_books(user_id).items():
+            if book['status'] != 'ready' and not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
                 books_to_remove.append(filename)
         
-        # Remove them from session
+        # Remove them from the book store and session
         for filename in books_to_remove:
-            if filename in session['book_history']:
-                del session['book_history'][filename]
+            with uploads_lock:
+                book_store.delete_book(user_id, filename)
+                release_upload(filename)
             if 'recent_books' in session and filename in session['recent_books']:
                 session['recent_books'].remove(filename)
             if session.get('current_book') == filename:
@@ -398,6 +880,62 @@ def cleanup_books():
         return {'status': 'error'}, 500
 
 
+def warm_up_models(job):
+    """Load the models into Ollama now rather than on the first question"""
+    job.update(message="Loading models")
+    # The same options as every generation, so the first question finds the
+    # model loaded with the context size it asks for
+    results = get_pool().warm_up(**GENERATE_OPTIONS)
+    if all(error is not None for error in results.values()):
+        raise LLMError("No Ollama backend could load its models")
+    for url, error in results.items():
+        if error:
+            logging.warning("Warm-up failed on %s: %s", url, error)
+    return results
+
+def create_app():
+    """Build the app's stores, start its background work and return it
+    (``gunicorn 'app:create_app()'``); later calls return the same app.
+    Serving `app` without calling this works too: the first request does it.
+
+    Importing this module only defines the routes: it opens no database and
+    loads no PDF or speech libraries (routes import those on first use).
+    With OLLAMA_WARMUP the models are loaded in the background and /ready
+    turns 200 once that is done. Disk quotas are enforced by a background
+    sweep.
+    """
+    global initialized, book_store, result_cache, summarizer, quiz_engine, memory, jobs, storage, warmup_job
+    with init_lock:
+        if initialized:
+            return app
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        book_store = BookStore(config.BOOK_STORE_PATH, config.TEXT_QUOTA_BYTES)
+        result_cache = ResultCache(config.RESULT_CACHE_PATH, config.RESULT_CACHE_MAX_BYTES, config.RESULT_CACHE_TTL)
+        # Partial summaries are cached alongside the finished results
+        summarizer = BookSummarizer(result_cache, model_for(NOTES), config.SUMMARY_CHUNK_TOKENS,
+                                    config.SUMMARY_CONCURRENCY)
+        quiz_engine = QuizEngine(result_cache, model_for(STUDY_AID), config.SUMMARY_CHUNK_TOKENS,
+                                 config.SUMMARY_CONCURRENCY, config.QUIZ_MAX_ATTEMPTS)
+        memory = ConversationMemory(book_store, config.MEMORY_RECENT_TURNS, config.MEMORY_SUMMARY_TOKENS,
+                                    config.SUMMARY_CHUNK_TOKENS)
+        jobs = JobManager(config.JOB_WORKERS, config.JOB_RETENTION)
+
+        storage = StorageManager(config.STORAGE_INDEX_PATH, config.STORAGE_EVICT_BATCH)
+        storage.add_category('uploads', config.UPLOAD_QUOTA_BYTES, app.config['UPLOAD_FOLDER'],
+                             lambda name: name.endswith('.pdf'), evict_upload)
+        storage.add_category('indexes', config.INDEX_QUOTA_BYTES, app.config['UPLOAD_FOLDER'],
+                             lambda name: name.endswith(INDEX_SUFFIX))
+        storage.add_category('audio', config.AUDIO_QUOTA_BYTES, TTS_FOLDER, lambda name: name.endswith('.mp3'))
+        storage.start(config.STORAGE_SWEEP_INTERVAL)
+        if config.OLLAMA_WARMUP:
+            warmup_job = jobs.submit('warmup', warm_up_models, key='warmup')
+        initialized = True
+    return app
+
+
 if __name__ == '__main__':
-    os.makedirs('uploads', exist_ok=True)
+    # The reloader's first process only watches for changes; the app and its
+    # background work run in the child it starts (WERKZEUG_RUN_MAIN is set there)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(debug=True)
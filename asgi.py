@@ -0,0 +1,150 @@
+"""ASGI entry point: ``uvicorn asgi:application``
+
+POST /stream_chat is served natively on the event loop, so a streaming chat
+costs a coroutine instead of a worker thread, and one process can hold
+hundreds of open streams. Every other route is the regular Flask app running
+through asgiref's WSGI adapter.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+import app as studymate
+from app import app, cached_answer, create_app, get_chat_inputs, remember_answer, save_exchange
+from models.llm import astream_llm
+from utils.metrics import HTTP_REQUESTS, HTTP_SECONDS
+from utils.sse import sse_event
+
+
+flask_app = WsgiToAsgi(create_app())
+
+SSE_HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+
+
+def load_session(scope):
+    """Decode the Flask session cookie for an ASGI request"""
+    headers = [(key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]]
+    environ = EnvironBuilder(path=scope["path"], method=scope["method"], headers=headers).get_environ()
+    return app.session_interface.open_session(app, Request(environ)) or {}
+
+
+async def read_body(receive):
+    """Full request body, or None if the client disconnected first"""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_text(send, status, text):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+def record_request(status, started):
+    HTTP_REQUESTS.inc(endpoint="/stream_chat", method="POST", status=str(status))
+    HTTP_SECONDS.observe(time.perf_counter() - started, endpoint="/stream_chat")
+
+
+async def stream_chat(scope, receive, send):
+    started = time.perf_counter()
+    body = await read_body(receive)
+    if body is None:
+        return
+    try:
+        question = json.loads(body or b"{}").get("question")
+    except ValueError:
+        question = None
+
+    session = load_session(scope)
+    user_id = session.get("user_id")
+    book_data = None
+    if user_id and session.get("current_book"):
+        book_data = await asyncio.to_thread(studymate.book_store.get_book, user_id, session["current_book"])
+
+    if not question or not book_data:
+        record_request(400, started)
+        return await send_text(send, 400, "Invalid data")
+    if book_data["status"] != "ready":
+        record_request(409, started)
+        return await send_text(send, 409, "Book is still being processed")
+
+    # Retrieval and SQLite reads are blocking; keep them off the event loop
+    cached = await asyncio.to_thread(cached_answer, user_id, book_data, question)
+    if cached is None:
+        book_context, history, summary = await asyncio.to_thread(get_chat_inputs, user_id, book_data, question)
+
+    record_request(200, started)
+    await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+
+    if cached is not None:
+        await asyncio.to_thread(save_exchange, user_id, book_data, question, cached)
+        await send({"type": "http.response.body", "body": sse_event(cached), "more_body": True})
+        await send({"type": "http.response.body", "body": sse_event({}, event="done"), "more_body": False})
+        return
+
+    async def relay():
+        # Each send() waits for the transport to drain, so a slow client
+        # slows reading from Ollama instead of buffering tokens in memory
+        answer, errors = [], []
+        async for token in astream_llm(question, book_context, book_data["original_name"], history,
+                                       summary=summary, errors=errors):
+            if not token:
+                continue
+            answer.append(token)
+            await send({"type": "http.response.body", "body": sse_event(token), "more_body": True})
+        return "".join(answer), not errors
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    relay_task = asyncio.ensure_future(relay())
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Cancelling the relay closes the upstream request, which stops the generation
+        for task in (relay_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+
+    if not relay_task.done() or relay_task.cancelled() or relay_task.exception() is not None:
+        return
+
+    answer, complete = relay_task.result()
+    await asyncio.to_thread(save_exchange, user_id, book_data, question, answer)
+    if complete:
+        await asyncio.to_thread(remember_answer, user_id, book_data, question, answer)
+    await send({"type": "http.response.body", "body": sse_event({}, event="done"), "more_body": False})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/stream_chat":
+        return await stream_chat(scope, receive, send)
+    return await flask_app(scope, receive, send)
@@ -0,0 +1,41 @@
+"""Synthetic PDF books for the benchmarks"""
+import os
+import random
+
+import fitz  # PyMuPDF
+
+
+VOCABULARY = """
+process thread scheduler memory page frame kernel interrupt queue priority
+deadlock mutex semaphore signal file system disk cache buffer latency
+throughput network socket packet protocol virtual address table segment
+allocation fragmentation paging swap policy fairness starvation context switch
+""".split()
+
+
+def generate_pdf(path, pages, words_per_page=350, seed=0):
+    """Write a `pages`-page PDF of pseudo-random study text to `path`"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        words = [rng.choice(VOCABULARY) for _ in range(words_per_page)]
+        # Break into sentences so text extraction sees realistic punctuation
+        sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), f"Chapter {number}\n\n" + " ".join(sentences),
+                            fontsize=9)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def build_corpus(folder, page_counts, words_per_page=350):
+    """One PDF per page count, reused across runs; returns {page_count: path}"""
+    os.makedirs(folder, exist_ok=True)
+    corpus = {}
+    for pages in page_counts:
+        path = os.path.join(folder, f"book_{pages}p.pdf")
+        if not os.path.exists(path):
+            generate_pdf(path, pages, words_per_page, seed=pages)
+        corpus[pages] = path
+    return corpus
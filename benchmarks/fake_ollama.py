@@ -0,0 +1,184 @@
+"""Local stand-in for Ollama's /api/generate, for benchmarks and offline runs.
+
+    python -m benchmarks.fake_ollama --port 11434 --tokens-per-second 30 --first-token-delay 0.3
+
+Streams NDJSON exactly like Ollama (one {"response", "done"} object per line,
+chunked) at a fixed token rate after a fixed time to first token, so the app
+can be measured without a model or a GPU. With `--load-delay`, the first
+request for each model also waits that long, like a cold model load, and so
+does a request with a different context size; a request without a prompt
+only loads the model, as in Ollama.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+FILLER_WORDS = ("the", "process", "scheduler", "thread", "memory", "page", "answer", "is",
+                "a", "simple", "example", "of", "how", "system", "works", "in", "practice")
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self._send_json(200, {"models": [{"name": self.server.model}]})
+        self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            return self._send_json(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.server.record(payload)
+        self.server.load_model(payload.get("model"), payload.get("options", {}).get("num_ctx"))
+        if not payload.get("prompt"):
+            return self._send_json(200, {"model": payload.get("model"), "response": "", "done": True,
+                                         "done_reason": "load"})
+
+        tokens = self.server.tokens_for(payload)
+        time.sleep(self.server.first_token_delay)
+        if not payload.get("stream", True):
+            time.sleep(self.server.token_interval * (len(tokens) - 1))
+            return self._send_json(200, {"model": payload.get("model"), "response": "".join(tokens), "done": True})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(self.server.token_interval)
+                self._write_chunk(json.dumps({"response": token, "done": False}).encode("utf-8") + b"\n")
+            self._write_chunk(json.dumps({"response": "", "done": True}).encode("utf-8") + b"\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up mid-stream (e.g. a cancelled SSE request)
+            self.server.record_abort()
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """Threaded fake Ollama server.
+
+    `tokens_per_second` sets the streaming rate, `first_token_delay` the
+    seconds before the first token and `response_tokens` the answer length.
+    Requests that ask for ``"format": "json"`` get a small valid JSON document.
+    `load_delay` is paid by the first request that uses a model, and again
+    when a request asks for a different context size (``options.num_ctx``),
+    which makes Ollama reload the model.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=11434, tokens_per_second=50.0, first_token_delay=0.2,
+                 response_tokens=64, model="fake", load_delay=0.0):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.first_token_delay = first_token_delay
+        self.response_tokens = response_tokens
+        self.model = model
+        self.load_delay = load_delay
+        self.loaded_models = {}  # model: num_ctx it was loaded with
+        self.requests = 0
+        self.aborted = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._thread = None
+
+    def record(self, payload):
+        with self._lock:
+            self.requests += 1
+            self.prompt_chars += len(payload.get("prompt", ""))
+
+    def load_model(self, model, num_ctx=None):
+        """Wait out the load delay unless `model` is loaded with `num_ctx` already"""
+        with self._load_lock:
+            if model in self.loaded_models and self.loaded_models[model] == num_ctx:
+                return
+            # Concurrent first requests all wait for the load, as in Ollama
+            time.sleep(self.load_delay)
+            self.loaded_models[model] = num_ctx
+
+    def record_abort(self):
+        with self._lock:
+            self.aborted += 1
+
+    def tokens_for(self, payload):
+        if payload.get("format"):
+            # Numbered so that items from different requests are distinct
+            n = self.requests
+            document = json.dumps({"items": [{
+                "question": f"Which component decides what runs next ({n})?",
+                "options": ["The scheduler", "The disk", "The compiler", "The editor"],
+                "answer": "A",
+                "term": f"Scheduler {n}",
+                "definition": "Decides which process runs next.",
+                "explanation": "Scheduling is covered in chapter one.",
+            }]})
+            # Split the document into roughly token-sized pieces
+            return [document[i:i + 4] for i in range(0, len(document), 4)]
+        words = [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(self.response_tokens)]
+        return [word + " " for word in words]
+
+    def handle_error(self, request, client_address):
+        # Clients closing idle keep-alive connections is routine, not an error
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "aborted": self.aborted, "prompt_chars": self.prompt_chars}
+
+    def start(self):
+        """Serve from a background thread; returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--load-delay", type=float, default=0.0, help="seconds to 'load' each model once")
+    args = parser.parse_args()
+
+    server = FakeOllama(args.host, args.port, args.tokens_per_second, args.first_token_delay, args.response_tokens,
+                        load_delay=args.load_delay)
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
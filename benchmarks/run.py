@@ -0,0 +1,396 @@
+"""Load test for the Flask app against a fake Ollama server.
+
+    python -m benchmarks.run --clients 8 --iterations 3 --pages 5,50,200 --output bench.json
+
+For each book size in the generated corpus, every endpoint is driven in its
+own phase by `--clients` concurrent clients (each with its own session),
+`--iterations` requests per client. The JSON report holds, per book size and
+endpoint: request and error counts, p50/p95/p99 latency, time to first token
+where the endpoint streams, throughput and the process's peak RSS during the
+phase.
+
+Everything runs in a scratch directory with the in-process Flask test client,
+so the numbers measure the app (routing, extraction, retrieval, prompting,
+SQLite, job queue) rather than a web server. App settings such as
+OLLAMA_MAX_CONCURRENCY or JOB_WORKERS are read from the environment as usual.
+`--backends N` starts N fake servers on consecutive ports and balances over
+them, to measure how throughput scales with Ollama processes.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fake_ollama import FakeOllama
+
+
+ENDPOINTS = ("/", "/chat", "/stream_chat", "/summarize", "/mcq", "/tts_ready")
+QUESTIONS = (
+    "What does the scheduler do?",
+    "Explain deadlock and starvation.",
+    "How does paging work with virtual addresses?",
+    "What is a context switch?",
+    "Summarize the chapter on file system caching.",
+    "Why do semaphores matter?",
+)
+JOB_URL_RE = re.compile(rb"/jobs/([0-9a-f]{32})")
+TTS_JOB_RE = re.compile(rb"job=([0-9a-f]{32})")
+POLL_INTERVAL = 0.02
+JOB_TIMEOUT = 600
+
+
+# Peak RSS
+
+def reset_peak_rss():
+    """Reset the kernel's high-water mark so the next reading covers one phase only"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """VmHWM of this process (falls back to the lifetime maximum off Linux)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+# Statistics
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def distribution_ms(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "mean": round(sum(values) / len(values) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+def format_ms(distribution, key):
+    return f"{distribution[key]:.0f}ms" if distribution else "-"
+
+
+def summarize_phase(samples, wall_time, peak_rss):
+    ok = [s for s in samples if s["ok"]]
+    errors = {}
+    for sample in samples:
+        if not sample["ok"]:
+            errors[sample["error"]] = errors.get(sample["error"], 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_types": errors,
+        "wall_seconds": round(wall_time, 3),
+        "throughput_rps": round(len(ok) / wall_time, 2) if wall_time else None,
+        "latency_ms": distribution_ms([s["latency"] for s in ok]),
+        "ttft_ms": distribution_ms([s["ttft"] for s in ok if s.get("ttft") is not None]),
+        "ready_ms": distribution_ms([s["ready"] for s in ok if s.get("ready") is not None]),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+# Client actions, called as action(client, iteration). Each returns a dict
+# of extra timings (seconds since the action started) and raises on anything
+# a user would see as a failure.
+
+class BenchClient:
+    """One simulated user: a Flask test client with its own session"""
+
+    def __init__(self, studymate, number):
+        self.studymate = studymate
+        self.number = number
+        self.http = studymate.app.test_client()
+        self.requests_made = 0
+
+    def question(self):
+        self.requests_made += 1
+        return QUESTIONS[(self.number + self.requests_made) % len(QUESTIONS)]
+
+    def session_value(self, key):
+        with self.http.session_transaction() as session:
+            return session.get(key)
+
+    def wait_for_book(self):
+        user_id, filename = self.session_value("user_id"), self.session_value("current_book")
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            status = self.studymate.book_store.get_book(user_id, filename)["status"]
+            if status != "processing":
+                return status
+            time.sleep(POLL_INTERVAL)
+        raise TimeoutError("book processing timed out")
+
+    def wait_for_job(self, job_id):
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            status = self.http.get(f"/jobs/{job_id}").get_json()["status"]
+            if status in ("done", "failed"):
+                return status
+            time.sleep(POLL_INTERVAL)
+        raise TimeoutError(f"job {job_id} timed out")
+
+
+def expect(response, *statuses):
+    if response.status_code not in statuses:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return response
+
+
+def upload_book(client, pdf_bytes, name):
+    started = time.perf_counter()
+    expect(client.http.post("/", data={"pdf": (io.BytesIO(pdf_bytes), name)},
+                            content_type="multipart/form-data"), 302)
+    uploaded = time.perf_counter() - started
+    if client.wait_for_book() != "ready":
+        raise RuntimeError("processing failed")
+    return {"latency": uploaded, "ready": time.perf_counter() - started}
+
+
+def chat(client, iteration):
+    expect(client.http.get("/chat"), 200)
+    expect(client.http.post("/chat", data={"question": client.question()}), 200)
+    return {}
+
+
+def stream_chat(client, iteration):
+    started = time.perf_counter()
+    response = expect(client.http.post("/stream_chat", json={"question": client.question()}, buffered=False), 200)
+    ttft = None
+    try:
+        for chunk in response.response:
+            if ttft is None and chunk.startswith(b"data: \""):
+                ttft = time.perf_counter() - started
+    finally:
+        response.close()
+    return {"ttft": ttft}
+
+
+def study_aid(path, cold):
+    def action(client, iteration):
+        response = expect(client.http.get(path + ("?regenerate=1" if cold else "")), 200)
+        match = JOB_URL_RE.search(response.data)
+        if match:
+            # Not cached yet: follow the loading page's job like the browser does
+            job_id = match.group(1).decode()
+            if client.wait_for_job(job_id) != "done":
+                raise RuntimeError("generation failed")
+            expect(client.http.get(f"{path}?job={job_id}"), 200)
+        return {}
+    return action
+
+
+def tts(client, iteration):
+    started = time.perf_counter()
+    response = expect(client.http.post("/tts", data={"voice": "en-US-AriaNeural"}), 200)
+    job_id = TTS_JOB_RE.search(response.data).group(1).decode()
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while True:
+        status = client.http.get(f"/tts_status?job={job_id}").get_json()
+        if status["playable"] or status["status"] in ("done", "failed"):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError("tts timed out")
+        time.sleep(POLL_INTERVAL)
+    page = expect(client.http.get(f"/tts_ready?job={job_id}"), 200)
+    if b"<audio" not in page.data:
+        raise RuntimeError("tts failed")
+    first_audio = time.perf_counter() - started
+    # Let the rest of the audio finish so phases don't overlap
+    while client.http.get(f"/tts_status?job={job_id}").get_json()["status"] not in ("done", "failed"):
+        time.sleep(POLL_INTERVAL)
+    return {"ttft": first_audio, "ready": time.perf_counter() - started}
+
+
+def run_phase(clients, iterations, action):
+    """Run `action` `iterations` times on every client concurrently"""
+    def run_client(client):
+        samples = []
+        for i in range(iterations):
+            started = time.perf_counter()
+            try:
+                extra = action(client, i)
+                samples.append({"ok": True, "latency": time.perf_counter() - started, **extra})
+            except Exception as e:
+                samples.append({"ok": False, "error": f"{type(e).__name__}: {e}"})
+        return samples
+
+    reset_peak_rss()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        futures = [pool.submit(run_client, client) for client in clients]
+        samples = [sample for future in futures for sample in future.result()]
+    return summarize_phase(samples, time.perf_counter() - started, peak_rss_bytes())
+
+
+def run(args):
+    corpus = build_corpus(args.corpus_dir, args.pages)
+    results = []
+
+    import app as studymate
+    studymate.app.testing = True
+    # Keep generated audio inside the scratch directory
+    studymate.app.static_folder = os.path.join(args.work_dir, "static")
+    studymate.TTS_FOLDER = os.path.join(studymate.app.static_folder, "tts")
+    studymate.create_app()
+
+    for pages, pdf_path in corpus.items():
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        clients = [BenchClient(studymate, n) for n in range(args.clients)]
+
+        def upload(client, iteration):
+            # Uploads are stored and extracted once per content hash, so every
+            # upload gets distinct bytes (a PDF comment after %%EOF) to be
+            # measured as a new book rather than a reuse
+            marker = f"% bench client {client.number} upload {iteration}\n".encode()
+            return upload_book(client, pdf_bytes + marker, f"c{client.number}_{iteration}_{pages}p.pdf")
+
+        actions = {
+            "/": upload,
+            "/chat": chat,
+            "/stream_chat": stream_chat,
+            "/summarize": study_aid("/summarize", args.cold),
+            "/mcq": study_aid("/mcq", args.cold),
+            "/tts_ready": tts,
+        }
+        # Later phases need a processed book, so the upload phase always runs
+        for endpoint in ("/",) + tuple(e for e in args.endpoints if e != "/"):
+            stats = run_phase(clients, args.iterations, actions[endpoint])
+            results.append({"pages": pages, "endpoint": endpoint, **stats})
+            print(f"{pages:>5}p {endpoint:<13} {stats['requests']:>4} req {stats['errors']:>3} err  "
+                  f"p50 {format_ms(stats['latency_ms'], 'p50')}  p95 {format_ms(stats['latency_ms'], 'p95')}  "
+                  f"ttft p50 {format_ms(stats['ttft_ms'], 'p50')}  {stats['throughput_rps']} req/s  "
+                  f"rss {stats['peak_rss_mb']} MB", file=sys.stderr)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients per phase")
+    parser.add_argument("--iterations", type=int, default=3, help="requests per client per phase")
+    parser.add_argument("--pages", default="5,50,200", help="comma-separated page counts of the corpus")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated endpoints to drive")
+    parser.add_argument("--cold", action="store_true",
+                        help="regenerate study aids and skip the chat answer cache")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="fake Ollama streaming rate")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="fake Ollama seconds to first token")
+    parser.add_argument("--response-tokens", type=int, default=64, help="fake Ollama answer length")
+    parser.add_argument("--ollama-port", type=int, default=11435, help="port of the first fake Ollama server")
+    parser.add_argument("--backends", type=int, default=1, help="fake Ollama servers to balance over")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "studymate-bench-corpus"))
+    parser.add_argument("--output", default="-", help="JSON report path ('-' for stdout)")
+    args = parser.parse_args(argv)
+    args.pages = [int(p) for p in args.pages.split(",") if p]
+    args.endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output != "-":
+        args.output = os.path.abspath(args.output)
+    args.corpus_dir = os.path.abspath(args.corpus_dir)
+
+    servers = [FakeOllama(port=args.ollama_port + i, tokens_per_second=args.tokens_per_second,
+                          first_token_delay=args.first_token_delay, response_tokens=args.response_tokens).start()
+               for i in range(args.backends)]
+
+    # The app reads its settings at import time, so point it at the fake
+    # server and a scratch directory before importing it
+    args.work_dir = tempfile.mkdtemp(prefix="studymate-bench-")
+    os.chdir(args.work_dir)
+    for folder in ("uploads", "data", "static"):
+        os.makedirs(folder, exist_ok=True)
+    os.environ.update({
+        "OLLAMA_BACKENDS": ",".join(f"http://127.0.0.1:{server.server_port}" for server in servers),
+        "UPLOAD_FOLDER": os.path.join(args.work_dir, "uploads"),
+        "DATA_FOLDER": os.path.join(args.work_dir, "data"),
+        "TTS_BACKEND": "stub",
+    })
+    if args.cold:
+        os.environ["ANSWER_CACHE_SIZE"] = "0"
+
+    started = time.time()
+    try:
+        results = run(args)
+    finally:
+        for server in servers:
+            server.stop()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    import config
+    report = {
+        "started": started,
+        "duration_seconds": round(time.time() - started, 2),
+        "settings": {
+            "clients": args.clients,
+            "iterations": args.iterations,
+            "pages": args.pages,
+            "cold": args.cold,
+            "tokens_per_second": args.tokens_per_second,
+            "first_token_delay": args.first_token_delay,
+            "response_tokens": args.response_tokens,
+            "backends": args.backends,
+            "ollama_max_concurrency": config.OLLAMA_MAX_CONCURRENCY,
+            "job_workers": config.JOB_WORKERS,
+            "pdf_workers": config.PDF_WORKERS,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "peak_rss_resettable": reset_peak_rss(),
+        },
+        "fake_ollama": [server.stats() for server in servers],
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
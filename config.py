@@ -0,0 +1,87 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Storage locations
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+DATA_FOLDER = os.getenv("DATA_FOLDER", "data")
+BOOK_STORE_PATH = os.getenv("BOOK_STORE_PATH", os.path.join(DATA_FOLDER, "studymate.db"))
+
+# Disk quotas: least recently used files go first once a category is over
+# its quota (bytes, 0 = unlimited); see utils/storage.py
+STORAGE_INDEX_PATH = os.getenv("STORAGE_INDEX_PATH", os.path.join(DATA_FOLDER, "storage.db"))
+UPLOAD_QUOTA_BYTES = int(os.getenv("UPLOAD_QUOTA_BYTES", str(10 * 1024 ** 3)))  # original PDFs; books keep their stored text
+INDEX_QUOTA_BYTES = int(os.getenv("INDEX_QUOTA_BYTES", str(2 * 1024 ** 3)))  # retrieval indexes, rebuilt on demand
+AUDIO_QUOTA_BYTES = int(os.getenv("AUDIO_QUOTA_BYTES", str(5 * 1024 ** 3)))  # generated MP3s
+TEXT_QUOTA_BYTES = int(os.getenv("TEXT_QUOTA_BYTES", str(1024 ** 3)))  # extracted book text (compressed), in BOOK_STORE_PATH
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "60"))  # seconds between quota checks
+STORAGE_EVICT_BATCH = int(os.getenv("STORAGE_EVICT_BATCH", "100"))  # files removed per category per sweep
+
+# Ollama backend
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "localhost")
+OLLAMA_PORT = int(os.getenv("OLLAMA_PORT", "11434"))
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "granite3.3:2b")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))  # max silence between tokens
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))  # in-flight generations
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "300"))  # wait for a free slot
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+
+# Ollama servers to balance over; see models/backend_pool.py for the format
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", f"http://{OLLAMA_HOST}:{OLLAMA_PORT}")
+OLLAMA_JOB_MODELS = os.getenv("OLLAMA_JOB_MODELS", "")  # e.g. "notes=llama3.1:8b", default OLLAMA_MODEL
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "2"))  # consecutive failures before ejecting a backend
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))  # seconds, 0 = no active checks
+
+# Model residency: load the models when the app starts and keep them loaded
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") == "1"
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "")  # e.g. "30m", or -1 for always; empty = Ollama's default
+
+# Generated study-aid cache (summaries, flashcards, MCQs)
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(DATA_FOLDER, "results.db"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0")) or None  # seconds, 0 = never expire
+
+# Background jobs (PDF extraction, study aids, audio)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))  # seconds finished jobs stay queryable
+
+# Text-to-speech
+TTS_BACKEND = os.getenv("TTS_BACKEND", "edge")  # edge, gtts or stub (offline)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))  # segments synthesized at once
+TTS_SEGMENT_CHARS = int(os.getenv("TTS_SEGMENT_CHARS", "400"))
+TTS_STUB_LATENCY = float(os.getenv("TTS_STUB_LATENCY", "0"))  # seconds per segment, stub backend only
+
+# PDF extraction
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "1000"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))  # processes for large books
+
+# Prompt budget
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))  # context window requested from Ollama
+OLLAMA_OUTPUT_TOKENS = int(os.getenv("OLLAMA_OUTPUT_TOKENS", "1024"))  # kept free for the answer
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.25"))
+
+# Diagnostics
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"  # honour ?profile=timing|cprofile
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(DATA_FOLDER, "profiles"))
+
+# Whole-book notes for summaries, flashcards, MCQs and narration
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))  # book text per partial summary
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY)))  # partials at once
+
+# MCQs and flashcards (sections and concurrency as for whole-book notes)
+QUIZ_SIZE = int(os.getenv("QUIZ_SIZE", "10"))  # items per quiz
+QUIZ_MAX_ATTEMPTS = int(os.getenv("QUIZ_MAX_ATTEMPTS", "3"))  # generations per section before giving up on items
+
+# Chat answer cache (per book, in memory)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))  # answers kept across all books, 0 = off
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))  # MinHash match threshold, 0 = normalized text must match
+
+# Conversation memory
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "4"))  # turns sent verbatim with each question
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))  # running summary of older turns
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))  # messages rendered per page of chat history
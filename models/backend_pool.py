@@ -0,0 +1,294 @@
+"""Several Ollama servers behind one generation interface.
+
+Each backend has its own connection pool and generation slots. A request
+goes to the least loaded backend that serves its job type, where load is
+in-flight plus queued generations relative to the backend's slots. A backend
+that fails `eject_after` times in a row, or fails a health check, gets no
+traffic for `eject_seconds`. Only connection, HTTP and stream errors count
+as failures; a busy backend whose slots time out is not ejected. A
+generation that fails before its first token is retried on another backend.
+
+Backends are configured as a comma-separated list of URLs, each optionally
+followed by space-separated settings:
+
+    OLLAMA_BACKENDS="http://gpu1:11434, http://gpu2:11434 concurrency=4, http://big:11434 jobs=notes+study_aid"
+
+A backend with ``jobs=`` only serves those job types, and those job types go
+only to such backends; everything else is shared by the backends without
+``jobs=``. OLLAMA_JOB_MODELS picks the model per job type, e.g.
+``notes=llama3.1:8b,study_aid=llama3.1:8b``.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from models.llm_client import AsyncLLMClient, LLMClient, LLMError, SlotTimeout
+from utils.metrics import LLM_BACKEND_EJECTIONS, LLM_BACKEND_REQUESTS
+
+
+logger = logging.getLogger(__name__)
+
+# Job types passed by callers
+CHAT = "chat"
+NOTES = "notes"  # partial and merged whole-book notes
+STUDY_AID = "study_aid"  # summaries, flashcards and MCQs from the notes
+MEMORY = "memory"  # running summaries of long conversations
+JOB_TYPES = (CHAT, NOTES, STUDY_AID, MEMORY)
+
+
+def parse_job_models(spec):
+    """{job type: model} from "job=model,job=model" """
+    models = {}
+    for entry in spec.split(","):
+        if "=" in entry:
+            job, model = entry.split("=", 1)
+            models[job.strip()] = model.strip()
+    return models
+
+
+JOB_MODELS = parse_job_models(config.OLLAMA_JOB_MODELS)
+
+
+def model_for(job):
+    """Model that generates for `job`"""
+    return JOB_MODELS.get(job, config.OLLAMA_MODEL)
+
+
+def parse_backends(spec):
+    """[(url, {setting: value})] from an OLLAMA_BACKENDS value"""
+    backends = []
+    for entry in spec.split(","):
+        parts = entry.split()
+        if not parts:
+            continue
+        settings = {}
+        for part in parts[1:]:
+            if "=" not in part:
+                raise ValueError(f"Invalid backend setting {part!r} in {entry.strip()!r}")
+            name, value = part.split("=", 1)
+            settings[name] = value
+        backends.append((parts[0], settings))
+    return backends
+
+
+class Backend:
+    """One Ollama server and its load and health state (guarded by the pool's lock)"""
+
+    def __init__(self, client, jobs=None):
+        self.client = client
+        self.jobs = frozenset(jobs) if jobs else None  # None: any job type
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self._async_client = None
+
+    @property
+    def url(self):
+        return self.client.base_url
+
+    @property
+    def load(self):
+        return self.outstanding / max(1, self.client.max_concurrency)
+
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = AsyncLLMClient(self.client)
+        return self._async_client
+
+
+class BackendPool:
+    """Least-loaded balancing with ejection of failing backends"""
+
+    def __init__(self, backends, eject_after=2, eject_seconds=30.0, health_interval=10.0):
+        if not backends:
+            raise ValueError("A backend pool needs at least one backend")
+        self.backends = list(backends)
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._health_thread = None
+
+    def _candidates(self, job):
+        dedicated = [b for b in self.backends if b.jobs and job in b.jobs]
+        return dedicated or [b for b in self.backends if b.jobs is None] or self.backends
+
+    def _acquire(self, job, tried):
+        """Reserve the least loaded backend for `job` not in `tried`, or None"""
+        with self._lock:
+            candidates = [b for b in self._candidates(job) if b not in tried]
+            if not candidates:
+                return None
+            now = time.monotonic()
+            # With every candidate ejected, trying one beats failing outright
+            available = [b for b in candidates if b.ejected_until <= now] or candidates
+            # Rotate the starting point so equally loaded backends take turns
+            self._turn += 1
+            order = {b: (i - self._turn) % len(available) for i, b in enumerate(available)}
+            backend = min(available, key=lambda b: (b.load, order[b]))
+            backend.outstanding += 1
+        LLM_BACKEND_REQUESTS.inc(backend=backend.url, job=job)
+        return backend
+
+    def _eject(self, backend, reason):
+        # Called with the lock held
+        if backend.ejected_until <= time.monotonic():
+            logger.warning("Ejecting Ollama backend %s for %.0fs: %s", backend.url, self.eject_seconds, reason)
+            LLM_BACKEND_EJECTIONS.inc(backend=backend.url)
+        backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    def _release(self, backend, error=None):
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                backend.failures = 0
+                backend.ejected_until = 0.0
+                return
+            if isinstance(error, SlotTimeout):
+                # Busy, not broken: ejecting it would only load the others more
+                return
+            backend.failures += 1
+            if backend.failures >= self.eject_after:
+                self._eject(backend, error)
+
+    def stream_generate(self, prompt, job=CHAT, **options):
+        """Yield response tokens from the least loaded backend serving `job`"""
+        tried, error = set(), None
+        while True:
+            backend = self._acquire(job, tried)
+            if backend is None:
+                raise error
+            tried.add(backend)
+            tokens = backend.client.stream_generate(prompt, **options)
+            streamed, error = False, None
+            try:
+                for token in tokens:
+                    streamed = True
+                    yield token
+                return
+            except Exception as e:
+                error = e
+                if streamed:
+                    raise
+            finally:
+                tokens.close()
+                self._release(backend, error)
+            logger.warning("Ollama backend %s failed, trying another: %s", backend.url, error)
+
+    async def astream_generate(self, prompt, job=CHAT, **options):
+        """asyncio counterpart of stream_generate"""
+        tried, error = set(), None
+        while True:
+            backend = self._acquire(job, tried)
+            if backend is None:
+                raise error
+            tried.add(backend)
+            tokens = backend.async_client().stream_generate(prompt, **options)
+            streamed, error = False, None
+            try:
+                async for token in tokens:
+                    streamed = True
+                    yield token
+                return
+            except Exception as e:
+                error = e
+                if streamed:
+                    raise
+            finally:
+                await tokens.aclose()
+                self._release(backend, error)
+            logger.warning("Ollama backend %s failed, trying another: %s", backend.url, error)
+
+    def models_by_backend(self):
+        """{backend: models it generates with} for the configured routing"""
+        models = {backend: set() for backend in self.backends}
+        for job in JOB_TYPES:
+            for backend in self._candidates(job):
+                models[backend].add(model_for(job))
+        return models
+
+    def warm_up(self, **options):
+        """Load every backend's models ahead of the first request.
+
+        `options` are the generation options passed to `load_model`. Returns
+        {backend url: error message, or None once loaded}; backends that fail
+        are ejected.
+        """
+        def load(item):
+            backend, models = item
+            try:
+                for model in sorted(models):
+                    backend.client.load_model(model, **options)
+            except LLMError as e:
+                with self._lock:
+                    self._eject(backend, e)
+                return backend.url, str(e)
+            return backend.url, None
+
+        with ThreadPoolExecutor(max_workers=len(self.backends), thread_name_prefix="warm-up") as pool:
+            return dict(pool.map(load, self.models_by_backend().items()))
+
+    def check_health(self):
+        """Ping every backend; eject the unreachable ones and restore the rest"""
+        for backend in self.backends:
+            healthy = backend.client.ping()
+            with self._lock:
+                if healthy:
+                    if backend.ejected_until:
+                        logger.info("Ollama backend %s is healthy again", backend.url)
+                    backend.failures = 0
+                    backend.ejected_until = 0.0
+                else:
+                    self._eject(backend, "health check failed")
+
+    def start_health_checks(self):
+        """Check health in a background thread (only useful with several backends)"""
+        if self._health_thread or self.health_interval <= 0 or len(self.backends) < 2:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.health_interval)
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=run, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+
+def build_pool(spec):
+    """BackendPool for an OLLAMA_BACKENDS value, using the client settings from config.py"""
+    backends = []
+    for url, settings in parse_backends(spec):
+        client = LLMClient(
+            url,
+            config.OLLAMA_MODEL,
+            connect_timeout=config.OLLAMA_CONNECT_TIMEOUT,
+            read_timeout=config.OLLAMA_READ_TIMEOUT,
+            max_retries=config.OLLAMA_MAX_RETRIES,
+            retry_backoff=config.OLLAMA_RETRY_BACKOFF,
+            max_concurrency=int(settings.get("concurrency", config.OLLAMA_MAX_CONCURRENCY)),
+            queue_timeout=config.OLLAMA_QUEUE_TIMEOUT,
+            pool_size=config.OLLAMA_POOL_SIZE,
+        )
+        jobs = settings.get("jobs")
+        backends.append(Backend(client, jobs.split("+") if jobs else None))
+    return BackendPool(backends, config.OLLAMA_EJECT_AFTER, config.OLLAMA_EJECT_SECONDS,
+                       config.OLLAMA_HEALTH_INTERVAL)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool configured from config.py"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = build_pool(config.OLLAMA_BACKENDS)
+                _pool.start_health_checks()
+    return _pool
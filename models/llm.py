@@ -1,117 +1,234 @@
-import requests
+import asyncio
 import json
-from dotenv import load_dotenv
+import threading
+import time
 
-load_dotenv()
+import config
+from models.backend_pool import CHAT, STUDY_AID, get_pool, model_for
+from models.llm_client import LLMError
+from models.prompt_builder import PromptBuilder
+from utils.metrics import (LLM_COALESCED, LLM_ERRORS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS, LLM_TOKENS_PER_SECOND,
+                           PROMPT_CHARS, PROMPT_TOKENS, span)
+from utils.result_cache import make_key
+from utils.single_flight import SingleFlight
+from utils.tokens import count_tokens
 
+ERROR_MESSAGE = "⚠️ Error processing your request."
+STREAM_ERROR_MESSAGE = "⚠️ Error streaming response."
 
-def ask_llm(question, context="", book_title="Untitled"):
+prompt_builder = PromptBuilder(config.OLLAMA_NUM_CTX, config.OLLAMA_OUTPUT_TOKENS, config.PROMPT_HISTORY_SHARE)
+
+
+def _keep_alive(value):
+    """OLLAMA_KEEP_ALIVE as Ollama expects it: a number of seconds or a duration such as 30m"""
     try:
-        url = "http://localhost:11434/api/generate"
-        headers = {
-            "Content-Type": "application/json"
-        }
-        # print(question+"\n\n\n\n\n===============================================================================================================\n\n\n\n\n"+context)
-        prompt = f"""
-        You are an AI tutor for all books in the world, built to assist students studying the book titled '{book_title}'.
-
-        🎯 Your goal is to answer questions in simple, clear, human-like responses using only proper HTML formatting.
-
-        🚫 DO NOT use (Strictly probhited !!):
-        - Asterisks (*) or (**) for bold
-        - Backticks (`) for code blocks
-        - Special characters or symbols
-        - Any other formatting that is not HTML
-        - Markdown
-        - Code blocks
-
-
-        ✅ You MUST use only valid HTML formatting:
-        - Use <h3> or <h4> for headings
-        - Use <b> for bold terms or answers
-        - Use <ol><li>...</li></ol> for ordered lists
-        - Use </br> for line breaks
-        - All other text must be plain (no special symbols or markdown)
-        - Use <h3> or <h4> for headings
-        - Use <b> for bold terms or answers
-        - Use <ol><li>...</li></ol> for ordered lists
-        - Use </br> for line breaks
-        - All other text must be plain (no special symbols or markdown)
-
-        🧠 Response Logic Rules:
-        - Focus ONLY on the actual question.
-        - If the question clearly depends on the context, then use the context.
-        - If the question is general (e.g., "Who built you?", "What is AI?"), IGNORE the PDF content.
-        - NEVER explain or reference the context unless it's required to answer the question.
-        - If the question is about the book, use the context.
-        - if contains points, then use </br></br><ol><li>...</li></ol> for tags or each point to separate them.
-        - Do NOT mention anything that was not asked.
-        - Conclude if answer has points, then use </br></br><ol><li>...</li></ol> for tags or each point to separate them. 
-
-
-        ----------------------------------------
-        📘 Book Title: {book_title}
-
-        📄 PDF Content (only use if needed):
-        {context[:3500]}
-
-        ❓ Question (strictly answer this question, not the context unless clearly needed):
-        {question}
-        """
-
-        payload = {
-            "model": "granite3.3:2b",
-            "prompt": prompt,
-            "stream": True
-        }
-
-        
-
-        response = requests.post(url, headers=headers, json=payload, stream=True)
-        response.raise_for_status()
-
-        output = ""
-        for line in response.iter_lines():
-            if line:
-                data = json.loads(line.decode("utf-8"))
-                output += data.get("response", "")
-        return output
+        return int(value)
+    except ValueError:
+        return value or None
+
+
+KEEP_ALIVE = _keep_alive(config.OLLAMA_KEEP_ALIVE)
+
+# Ask Ollama for the same context window the prompt was budgeted for, and to
+# keep the model loaded for KEEP_ALIVE after each request
+GENERATE_OPTIONS = {"options": {"num_ctx": config.OLLAMA_NUM_CTX}}
+if KEEP_ALIVE is not None:
+    GENERATE_OPTIONS["keep_alive"] = KEEP_ALIVE
+
+# Identical prompts in flight at the same time share one upstream generation
+coalescer = SingleFlight()
+
+
+def build_prompt(question, context, book_title, history, summary=""):
+    with span("prompt_build"):
+        prompt = prompt_builder.build(question, book_title, context, history, summary)
+    PROMPT_CHARS.observe(len(prompt))
+    PROMPT_TOKENS.observe(count_tokens(prompt))
+    return prompt
+
+
+class _StreamTimer:
+    """Records time to first token and tokens/second for one generation"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            LLM_FIRST_TOKEN_SECONDS.observe(self.first_token - self.started, mode=self.mode)
+        self.tokens += 1
+
+    def finish(self):
+        LLM_TOKENS.inc(self.tokens, mode=self.mode)
+        if self.first_token is not None and self.tokens > 1:
+            elapsed = time.perf_counter() - self.first_token
+            if elapsed > 0:
+                LLM_TOKENS_PER_SECOND.observe((self.tokens - 1) / elapsed, mode=self.mode)
+
+
+def _generation_key(prompt, model):
+    return make_key(model, json.dumps(GENERATE_OPTIONS, sort_keys=True), prompt)
+
+
+def _complete(key, flight, cache, cache_key, error=None):
+    """Publish the end of a generation; successful results reach the cache
+    before the flight is forgotten, so later requests find them there"""
+    if error is None and cache is not None and cache_key:
+        cache.set(cache_key, flight.text)
+    coalescer.forget(key, flight)
+    flight.finish(error)
+
+
+def _produce(key, flight, prompt, job, mode, cache, cache_key):
+    """Thread: run one upstream generation and publish it to the flight"""
+    timer = _StreamTimer(mode)
+    tokens = get_pool().stream_generate(prompt, job, model=model_for(job), **GENERATE_OPTIONS)
+    try:
+        for token in tokens:
+            timer.token()
+            flight.publish(token)
+            if flight.abandoned:
+                # Every subscriber left; closing the stream frees the slot
+                return _complete(key, flight, None, None, LLMError("Generation abandoned"))
+        timer.finish()
+        _complete(key, flight, cache, cache_key)
+    except Exception as e:
+        _complete(key, flight, None, None, e)
+    finally:
+        tokens.close()
+
+
+async def _aproduce(key, flight, prompt, job, mode, cache, cache_key):
+    """Task: asyncio counterpart of _produce"""
+    timer = _StreamTimer(mode)
+    tokens = get_pool().astream_generate(prompt, job, model=model_for(job), **GENERATE_OPTIONS)
+    try:
+        async for token in tokens:
+            timer.token()
+            flight.publish(token)
+        timer.finish()
+        # The SQLite write would block the event loop
+        await asyncio.to_thread(_complete, key, flight, cache, cache_key)
+    except asyncio.CancelledError:
+        _complete(key, flight, None, None, LLMError("Generation abandoned"))
+    except Exception as e:
+        _complete(key, flight, None, None, e)
+    finally:
+        await tokens.aclose()
+
+
+def _join_generation(prompt, job, mode, cache=None, cache_key=None):
+    """Flight generating `prompt`, started in a thread unless one is already running"""
+    key = _generation_key(prompt, model_for(job))
+    flight, leader = coalescer.join(key)
+    if leader:
+        threading.Thread(target=_produce, args=(key, flight, prompt, job, mode, cache, cache_key),
+                         name="llm-generation", daemon=True).start()
+    else:
+        LLM_COALESCED.inc(mode=mode)
+    return flight
+
+
+def _ajoin_generation(prompt, job, mode, cache=None, cache_key=None):
+    """Like _join_generation, with the producer as a task on the running loop"""
+    key = _generation_key(prompt, model_for(job))
+    flight, leader = coalescer.join(key)
+    if leader:
+        task = asyncio.ensure_future(_aproduce(key, flight, prompt, job, mode, cache, cache_key))
+        loop = asyncio.get_running_loop()
+        flight.cancel = lambda: loop.call_soon_threadsafe(task.cancel)
+    else:
+        LLM_COALESCED.inc(mode=mode)
+    return flight
+
+
+def ask_llm(question, context="", book_title="Untitled", history=(), cache=None, cache_key=None, job=CHAT,
+            summary=""):
+    """Answer `question`; with `cache` the finished answer is stored under `cache_key`.
+
+    `job` picks the backends and model (see models/backend_pool.py);
+    `summary` condenses conversation older than `history`.
+    """
+    try:
+        prompt = build_prompt(question, context, book_title, history, summary)
+        with span("llm_generate"):
+            return "".join(_join_generation(prompt, job, "generate", cache, cache_key).follow())
 
     except Exception as e:
         print("🔥 LLM Exception:", e)
-        return "⚠️ Error processing your request."
+        LLM_ERRORS.inc(mode="generate")
+        return ERROR_MESSAGE
 
-# Add this in llm.py
-def stream_llm(question, context="", book_title="Untitled"):
+def stream_llm(question, context="", book_title="Untitled", history=(), cache=None, cache_key=None, job=CHAT,
+               summary="", errors=None):
+    """Stream the answer to `question`; a failure ends the stream with
+    STREAM_ERROR_MESSAGE and its exception is appended to `errors`"""
+    try:
+        prompt = build_prompt(question, context, book_title, history, summary)
+        yield from _join_generation(prompt, job, "stream", cache, cache_key).follow()
+    except Exception as e:
+        print("🔥 Stream Error:", e)
+        LLM_ERRORS.inc(mode="stream")
+        if errors is not None:
+            errors.append(e)
+        yield STREAM_ERROR_MESSAGE
+
+async def astream_llm(question, context="", book_title="Untitled", history=(), cache=None, cache_key=None,
+                      job=CHAT, summary="", errors=None):
+    """asyncio version of stream_llm for the ASGI endpoint"""
     try:
-        url = "http://localhost:11434/api/generate"
-        headers = {"Content-Type": "application/json"}
-
-        prompt = f"""
-        You are an AI tutor for all books in the world, built to assist students studying the book titled '{book_title}'.
-        (same HTML-only formatting rules here...)
-
-        ----------------------------------------
-        Book Title: {book_title}
-        PDF Content:
-        {context[:3500]}
-        Question:
-        {question}
-        """
-
-        payload = {
-            "model": "granite3.3:2b",
-            "prompt": prompt,
-            "stream": True
-        }
-
-        response = requests.post(url, headers=headers, json=payload, stream=True)
-        response.raise_for_status()
-
-        for line in response.iter_lines():
-            if line:
-                data = json.loads(line.decode("utf-8"))
-                yield data.get("response", "")
+        prompt = build_prompt(question, context, book_title, history, summary)
+        async for token in _ajoin_generation(prompt, job, "async", cache, cache_key).afollow():
+            yield token
     except Exception as e:
         print("🔥 Stream Error:", e)
-        yield "⚠️ Error streaming response."
+        LLM_ERRORS.inc(mode="async")
+        if errors is not None:
+            errors.append(e)
+        yield STREAM_ERROR_MESSAGE
+
+def generate_text(prompt, job, cache=None, cache_key=None):
+    """Send `prompt` as is, without the tutor template, and return the response.
+
+    For internal generations (notes, summaries) whose prompt carries its own
+    instructions. Identical prompts in flight share one generation; with
+    `cache` the result is stored under `cache_key`. Raises LLMError on failure.
+    """
+    PROMPT_CHARS.observe(len(prompt))
+    PROMPT_TOKENS.observe(count_tokens(prompt))
+    try:
+        with span("llm_generate"):
+            return "".join(_join_generation(prompt, job, "text", cache, cache_key).follow())
+    except Exception as e:
+        LLM_ERRORS.inc(mode="text")
+        if isinstance(e, LLMError):
+            raise
+        raise LLMError(f"Generation failed: {e}") from e
+
+def generate_json(prompt, schema, job=STUDY_AID):
+    """Send `prompt` as is, with output constrained to the JSON `schema`
+    (Ollama's `format`), and return the parsed document.
+
+    Raises LLMError if the generation fails or the output is not JSON.
+    """
+    PROMPT_CHARS.observe(len(prompt))
+    PROMPT_TOKENS.observe(count_tokens(prompt))
+    timer = _StreamTimer("json")
+    try:
+        with span("llm_generate"):
+            tokens = get_pool().stream_generate(prompt, job, model=model_for(job), format=schema, **GENERATE_OPTIONS)
+            text = ""
+            for token in tokens:
+                timer.token()
+                text += token
+        timer.finish()
+        return json.loads(text)
+    except Exception as e:
+        LLM_ERRORS.inc(mode="json")
+        if isinstance(e, LLMError):
+            raise
+        raise LLMError(f"Structured generation failed: {e}") from e
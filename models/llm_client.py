@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import span
+
+
+class LLMError(Exception):
+    """Raised when the Ollama backend cannot serve a generation"""
+
+
+class SlotTimeout(LLMError):
+    """Raised when every generation slot stayed busy for the whole queue timeout"""
+
+
+class LLMClient:
+    """Shared HTTP client for Ollama's /api/generate endpoint.
+
+    One pooled `requests.Session` keeps connections to the backend alive
+    between questions, every request has connect/read timeouts, connection
+    failures are retried with exponential backoff, and a semaphore caps how
+    many generations run against the local model at once.
+    """
+
+    def __init__(self, base_url, model, connect_timeout=5.0, read_timeout=120.0,
+                 max_retries=2, retry_backoff=0.5, max_concurrency=2,
+                 queue_timeout=300.0, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue_timeout = queue_timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    @property
+    def generate_url(self):
+        return f"{self.base_url}/api/generate"
+
+    def ping(self):
+        """True if the server answers /api/tags"""
+        try:
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout[0])
+            return response.ok
+        except requests.RequestException:
+            return False
+
+    def load_model(self, model=None, **options):
+        """Have Ollama load a model into memory without generating anything.
+
+        `options` should match what generations send (``options.num_ctx``,
+        ``keep_alive``): Ollama reloads a model whose context size changes.
+        """
+        payload = {"model": model or self.model, "stream": False}
+        payload.update(options)
+        try:
+            response = self.session.post(self.generate_url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise LLMError(f"Loading {payload['model']} on {self.base_url} failed: {e}") from e
+
+    def _post(self, payload):
+        """POST with bounded retries; only connection-level failures are retried"""
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.generate_url, json=payload, stream=True, timeout=self.timeout)
+                response.raise_for_status()
+                return response
+            except (requests.ConnectionError, requests.ConnectTimeout) as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"Ollama unreachable at {self.base_url}: {e}") from e
+                time.sleep(self.retry_backoff * (2 ** attempt))
+                attempt += 1
+
+    def stream_generate(self, prompt, model=None, **options):
+        """Yield response tokens as Ollama produces them"""
+        with span("llm_queue_wait"):
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        if not acquired:
+            raise SlotTimeout("Timed out waiting for a free generation slot")
+        try:
+            payload = {"model": model or self.model, "prompt": prompt, "stream": True}
+            payload.update(options)
+            with self._post(payload) as response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise LLMError(data["error"])
+                    yield data.get("response", "")
+                    if data.get("done"):
+                        break
+        finally:
+            self._slots.release()
+
+    def generate(self, prompt, model=None, **options):
+        return "".join(self.stream_generate(prompt, model=model, **options))
+
+
+class AsyncLLMClient:
+    """asyncio counterpart of LLMClient for the ASGI streaming endpoint.
+
+    It shares the sync client's settings and generation slots, so the
+    concurrency cap holds across both paths. Waiting for a slot polls instead
+    of parking a thread, which keeps hundreds of queued streams cheap and
+    lets a disconnected client drop out of the queue. httpx is only imported
+    once a stream starts, so WSGI-only processes never load it.
+    """
+
+    SLOT_POLL_INTERVAL = 0.05
+
+    def __init__(self, client):
+        self.client = client
+        self._http = None
+
+    def _http_client(self):
+        if self._http is None:
+            import httpx
+            connect_timeout, read_timeout = self.client.timeout
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._http
+
+    async def _acquire_slot(self):
+        deadline = time.monotonic() + self.client.queue_timeout
+        while not self.client._slots.acquire(blocking=False):
+            if time.monotonic() > deadline:
+                raise SlotTimeout("Timed out waiting for a free generation slot")
+            await asyncio.sleep(self.SLOT_POLL_INTERVAL)
+
+    async def stream_generate(self, prompt, model=None, **options):
+        """Async generator of response tokens; closing it aborts the upstream request"""
+        import httpx
+        with span("llm_queue_wait"):
+            await self._acquire_slot()
+        try:
+            payload = {"model": model or self.client.model, "prompt": prompt, "stream": True}
+            payload.update(options)
+            attempt = 0
+            while True:
+                try:
+                    async with self._http_client().stream("POST", self.client.generate_url, json=payload) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            data = json.loads(line)
+                            if "error" in data:
+                                raise LLMError(data["error"])
+                            yield data.get("response", "")
+                            if data.get("done"):
+                                break
+                    return
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    if attempt >= self.client.max_retries:
+                        raise LLMError(f"Ollama unreachable at {self.client.base_url}: {e}") from e
+                    await asyncio.sleep(self.client.retry_backoff * (2 ** attempt))
+                    attempt += 1
+        finally:
+            self.client._slots.release()
+
@@ -0,0 +1,72 @@
+from models.backend_pool import MEMORY
+from models.llm import generate_text
+from utils.tokens import count_tokens, truncate_to_tokens
+
+
+FOLD_PROMPT = (
+    "Update the running summary of a study conversation about the book '{title}'. "
+    "Below are the summary so far followed by newer questions and answers. "
+    "Write one updated summary in at most {words} words that keeps what the student asked, "
+    "the key facts they were given and anything they said they found unclear. "
+    "Use plain sentences, no Markdown or HTML."
+)
+
+FOLD_TEMPLATE = "{instruction}\n\nSummary so far: {summary}\n\n{turns}"
+TURN_TEMPLATE = "Question: {question}\nAnswer: {answer}"
+
+
+class ConversationMemory:
+    """Chat history as a running summary plus the most recent turns.
+
+    Every exchange is stored in full in the book store. The prompt only gets
+    the last `recent_turns` turns verbatim and a summary of everything older,
+    so its size stays the same however long a chat runs. `fold` brings the
+    summary up to date after an answer; it calls the model and is meant to
+    run in the background.
+    """
+
+    def __init__(self, store, recent_turns=4, summary_tokens=300, fold_tokens=3000):
+        self.store = store
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.fold_tokens = fold_tokens
+
+    def recall(self, user_id, filename):
+        """(recent turns, summary of the turns before them) for a prompt"""
+        summary, through_id = self.store.get_chat_summary(user_id, filename)
+        recent = self.store.get_chat_history(user_id, filename, limit=self.recent_turns)
+        # Until the background fold catches up, turns between the summary and
+        # the recent ones are left out rather than growing the prompt
+        return [turn for turn in recent if turn["id"] > through_id], summary
+
+    def needs_fold(self, user_id, filename):
+        _, through_id = self.store.get_chat_summary(user_id, filename)
+        return len(self.store.get_messages_after(user_id, filename, through_id)) > self.recent_turns
+
+    def _batch(self, turns):
+        """Oldest turns whose text fits one fold, at least one"""
+        batch, used = [], 0
+        for turn in turns:
+            text = TURN_TEMPLATE.format(**turn)
+            cost = count_tokens(text)
+            if batch and used + cost > self.fold_tokens:
+                break
+            batch.append(text)
+            used += cost
+        return batch
+
+    def fold(self, user_id, filename, title):
+        """Fold every turn older than the recent ones into the running summary"""
+        while True:
+            summary, through_id = self.store.get_chat_summary(user_id, filename)
+            pending = self.store.get_messages_after(user_id, filename, through_id)
+            older = pending[:-self.recent_turns] if self.recent_turns else pending
+            if not older:
+                return summary
+            batch = self._batch(older)
+            words = max(50, self.summary_tokens * 3 // 4)
+            prompt = FOLD_TEMPLATE.format(instruction=FOLD_PROMPT.format(words=words, title=title),
+                                          summary=summary or "(none yet)", turns="\n\n".join(batch))
+            result = generate_text(prompt, MEMORY)
+            summary = truncate_to_tokens(result.strip(), self.summary_tokens)
+            self.store.set_chat_summary(user_id, filename, summary, older[len(batch) - 1]["id"])
@@ -0,0 +1,127 @@
+from string import Template
+
+from utils.tokens import count_tokens, truncate_to_tokens
+
+
+# Compiled once at import; only the $-placeholders change per request.
+TUTOR_PROMPT = Template("""You are an AI tutor for all books in the world, built to assist students studying the book titled '$book_title'.
+
+🎯 Your goal is to answer questions in simple, clear, human-like responses using only proper HTML formatting.
+
+🚫 DO NOT use (Strictly probhited !!):
+- Asterisks (*) or (**) for bold
+- Backticks (`) for code blocks
+- Special characters or symbols
+- Any other formatting that is not HTML
+- Markdown
+- Code blocks
+
+✅ You MUST use only valid HTML formatting:
+- Use <h3> or <h4> for headings
+- Use <b> for bold terms or answers
+- Use <ol><li>...</li></ol> for ordered lists
+- Use </br> for line breaks
+- All other text must be plain (no special symbols or markdown)
+
+🧠 Response Logic Rules:
+- Focus ONLY on the actual question.
+- If the question clearly depends on the context, then use the context.
+- If the question is general (e.g., "Who built you?", "What is AI?"), IGNORE the PDF content.
+- NEVER explain or reference the context unless it's required to answer the question.
+- If the question is about the book, use the context.
+- if contains points, then use </br></br><ol><li>...</li></ol> for tags or each point to separate them.
+- Do NOT mention anything that was not asked.
+- Conclude if answer has points, then use </br></br><ol><li>...</li></ol> for tags or each point to separate them.
+
+----------------------------------------
+📘 Book Title: $book_title
+
+📄 PDF Content (only use if needed):
+$context
+$history
+❓ Question (strictly answer this question, not the context unless clearly needed):
+$question
+""")
+
+HISTORY_HEADER = "\n💬 Earlier in this conversation:\n"
+SUMMARY_TEMPLATE = Template("Summary of earlier questions and answers: $summary\n")
+TURN_TEMPLATE = Template("Question: $question\nAnswer: $answer\n")
+CHUNK_TEMPLATE = Template("[Page $page]\n$text")
+
+_FIXED_TOKENS = count_tokens(TUTOR_PROMPT.template) + count_tokens(HISTORY_HEADER)
+
+
+class PromptBuilder:
+    """Assembles the tutor prompt within the model's context window.
+
+    The token budget is the context size minus room reserved for the answer.
+    After the fixed rules and the question, up to `history_share` of what is
+    left goes to the conversation (the running summary of older turns first,
+    then the most recent turns) and the rest to book chunks (any history
+    budget left unused also goes to the book).
+    """
+
+    def __init__(self, context_tokens, output_tokens, history_share=0.25):
+        self.context_tokens = context_tokens
+        self.output_tokens = output_tokens
+        self.history_share = history_share
+
+    @property
+    def input_budget(self):
+        return self.context_tokens - self.output_tokens
+
+    def build(self, question, book_title="Untitled", context="", history=(), summary=""):
+        """Return the prompt for `question`.
+
+        `context` is either plain book text (trimmed to fit) or a list of
+        {"page", "text"} chunks ordered most relevant first. `history` is a
+        list of {"question", "answer"} turns, oldest first, and `summary`
+        condenses the turns before them.
+        """
+        available = self.input_budget - _FIXED_TOKENS - 2 * count_tokens(book_title) - count_tokens(question)
+        available = max(available, 0)
+
+        history_budget = int(available * self.history_share)
+        summary_text = ""
+        if summary:
+            summary_text = SUMMARY_TEMPLATE.substitute(summary=truncate_to_tokens(summary.strip(), history_budget))
+        history_text = summary_text + self._fit_history(history, history_budget - count_tokens(summary_text))
+        context_budget = available - count_tokens(history_text)
+        if isinstance(context, str):
+            context_text = truncate_to_tokens(context.strip(), context_budget)
+        else:
+            context_text = self._fit_chunks(context, context_budget)
+
+        return TUTOR_PROMPT.substitute(
+            book_title=book_title,
+            context=context_text,
+            history=HISTORY_HEADER + history_text if history_text else "",
+            question=question,
+        )
+
+    @staticmethod
+    def _fit_history(history, budget):
+        """Newest turns that fit in `budget`, rendered oldest first"""
+        turns, used = [], 0
+        for turn in reversed(list(history)):
+            text = TURN_TEMPLATE.substitute(question=turn["question"], answer=turn["answer"])
+            cost = count_tokens(text)
+            if used + cost > budget:
+                break
+            turns.append(text)
+            used += cost
+        return "".join(reversed(turns))
+
+    @staticmethod
+    def _fit_chunks(chunks, budget):
+        """Most relevant chunks that fit in `budget`, rendered in page order"""
+        selected, used = [], 0
+        for chunk in chunks:
+            text = CHUNK_TEMPLATE.substitute(page=chunk["page"], text=chunk["text"])
+            cost = count_tokens(text) + 1
+            if used + cost > budget:
+                continue
+            selected.append((chunk["page"], text))
+            used += cost
+        selected.sort(key=lambda item: item[0])
+        return "\n\n".join(text for _, text in selected)
@@ -0,0 +1,244 @@
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from models.backend_pool import STUDY_AID
+from models.llm import generate_json
+from models.llm_client import LLMError
+from models.summarizer import split_sections
+from utils.metrics import QUIZ_ITEMS
+from utils.result_cache import make_key
+
+
+logger = logging.getLogger(__name__)
+
+LETTERS = "ABCD"
+OPTION_LABEL_RE = re.compile(r"^\s*(?:\(?[A-Da-d][).:]|[A-Da-d]\s*-)\s+")
+
+MCQ_PROMPT = (
+    "Write {count} multiple choice questions that test understanding of the passage below, "
+    "taken from pages {first}-{last} of the book '{title}'. Ask about important concepts, "
+    "definitions and facts, not trivia. Every question has exactly 4 options, one of them correct; "
+    "give the correct option's letter (A, B, C or D) as the answer and explain it in one sentence.{avoid}\n\n"
+    "Passage:\n{text}\n\n"
+    'Reply with JSON only: {{"items": [{{"question": "...", "options": ["...", "...", "...", "..."], '
+    '"answer": "A", "explanation": "..."}}]}}'
+)
+
+FLASHCARD_PROMPT = (
+    "Write {count} flashcards for the most important concepts or definitions in the passage below, "
+    "taken from pages {first}-{last} of the book '{title}'. The term is a short name; the definition "
+    "explains it in one or two plain sentences.{avoid}\n\n"
+    "Passage:\n{text}\n\n"
+    'Reply with JSON only: {{"items": [{{"term": "...", "definition": "..."}}]}}'
+)
+
+AVOID_TEMPLATE = "\nDo not repeat any of these: {items}."
+
+
+def _items_schema(properties, required):
+    return {
+        "type": "object",
+        "properties": {"items": {"type": "array", "items": {
+            "type": "object", "properties": properties, "required": required}}},
+        "required": ["items"],
+    }
+
+
+MCQ_SCHEMA = _items_schema({
+    "question": {"type": "string"},
+    "options": {"type": "array", "items": {"type": "string"}, "minItems": 4, "maxItems": 4},
+    "answer": {"type": "string", "enum": list(LETTERS)},
+    "explanation": {"type": "string"},
+}, ["question", "options", "answer"])
+
+FLASHCARD_SCHEMA = _items_schema({
+    "term": {"type": "string"},
+    "definition": {"type": "string"},
+}, ["term", "definition"])
+
+
+def _text(value):
+    return " ".join(str(value).split()) if isinstance(value, (str, int, float)) else ""
+
+
+def validate_mcq(raw):
+    """(clean question, whether it needed repair), or (None, False) if unusable"""
+    if not isinstance(raw, dict):
+        return None, False
+    repaired = False
+    question = _text(raw.get("question"))
+    options = raw.get("options")
+    if isinstance(options, dict):
+        # {"A": "...", "B": "..."}
+        options = [options[key] for key in sorted(options)]
+        repaired = True
+    if not question or not isinstance(options, list) or len(options) != 4:
+        return None, False
+    cleaned = []
+    for option in options:
+        text = _text(option)
+        stripped = OPTION_LABEL_RE.sub("", text)
+        repaired = repaired or stripped != text
+        cleaned.append(stripped)
+    if not all(cleaned) or len({option.lower() for option in cleaned}) < 4:
+        return None, False
+
+    answer = _text(raw.get("answer"))
+    lowered = [option.lower() for option in cleaned]
+    if len(answer) == 1 and answer.upper() in LETTERS:
+        letter = answer.upper()
+    elif answer.lower() in lowered:
+        # The answer was given as the option's text
+        letter = LETTERS[lowered.index(answer.lower())]
+        repaired = True
+    elif OPTION_LABEL_RE.match(answer + " "):
+        # "B)", "(b)" or "B. <option text>"
+        letter = answer.lstrip("( ")[0].upper()
+        repaired = True
+    else:
+        return None, False
+    return {"question": question, "options": cleaned, "answer": letter,
+            "explanation": _text(raw.get("explanation"))}, repaired
+
+
+def validate_flashcard(raw):
+    """(clean flashcard, whether it needed repair), or (None, False) if unusable"""
+    if not isinstance(raw, dict):
+        return None, False
+    term, definition = _text(raw.get("term")), _text(raw.get("definition"))
+    repaired = False
+    if not term or not definition:
+        # Common alternative field names
+        term = term or _text(raw.get("front") or raw.get("concept"))
+        definition = definition or _text(raw.get("back") or raw.get("explanation"))
+        repaired = True
+    if not term or not definition:
+        return None, False
+    return {"term": term, "definition": definition}, repaired
+
+
+class QuizKind:
+    """How to ask for, check and identify one kind of quiz item"""
+
+    def __init__(self, name, prompt, schema, validate, label_field):
+        self.name = name
+        self.prompt = prompt
+        self.schema = schema
+        self.validate = validate
+        self.label_field = label_field
+
+    def label(self, item):
+        """Normalized text that identifies an item, for spotting repeats"""
+        return item[self.label_field].lower().strip(" ?.!")
+
+
+KINDS = {
+    "mcq": QuizKind("mcq", MCQ_PROMPT, MCQ_SCHEMA, validate_mcq, "question"),
+    "flashcards": QuizKind("flashcards", FLASHCARD_PROMPT, FLASHCARD_SCHEMA, validate_flashcard, "term"),
+}
+
+
+def plan_shards(sections, count):
+    """[(section, items to write)] spreading `count` items evenly over the book"""
+    if not sections or count <= 0:
+        return []
+    if len(sections) >= count:
+        step = (len(sections) - 1) / max(1, count - 1)
+        return [(sections[round(i * step)], 1) for i in range(count)]
+    base, extra = divmod(count, len(sections))
+    return [(section, base + (1 if i < extra else 0)) for i, section in enumerate(sections)]
+
+
+class QuizEngine:
+    """MCQs and flashcards written section by section as JSON.
+
+    The book is split into sections of at most `chunk_tokens` and the items
+    are spread over them; every section is asked for its few items in its
+    own JSON-constrained generation, up to `concurrency` at a time. Each
+    item is validated on its own; fixable problems (option labels, the
+    answer given as text) are repaired, and only the items that are still
+    missing are asked for again, up to `max_attempts` calls per section.
+    Completed sections are cached under a key derived from their text.
+    """
+
+    def __init__(self, cache, model, chunk_tokens=3000, concurrency=2, max_attempts=3):
+        self.cache = cache
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+
+    def _request(self, kind, section, count, title, avoid):
+        """Valid items from one generation (possibly fewer than `count`)"""
+        prompt = kind.prompt.format(
+            count=count, first=section.first, last=section.last, title=title, text=section.text,
+            avoid=AVOID_TEMPLATE.format(items="; ".join(avoid)) if avoid else "")
+        document = generate_json(prompt, kind.schema, STUDY_AID)
+        raw_items = document.get("items") if isinstance(document, dict) else document
+        items = []
+        for raw in raw_items if isinstance(raw_items, list) else []:
+            item, repaired = kind.validate(raw)
+            QUIZ_ITEMS.inc(kind=kind.name, outcome="rejected" if item is None else "repaired" if repaired else "valid")
+            if item is not None:
+                items.append(item)
+        return items
+
+    def _section_items(self, kind, section, count, title, fresh):
+        key = make_key("quiz-section", kind.name, self.model, str(count), section.text)
+        if not fresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+
+        items, seen = [], set()
+        for _ in range(self.max_attempts):
+            missing = count - len(items)
+            if missing <= 0:
+                break
+            try:
+                new_items = self._request(kind, section, missing, title, [item[kind.label_field] for item in items])
+            except LLMError as e:
+                logger.warning("Quiz generation failed for pages %d-%d: %s", section.first, section.last, e)
+                continue
+            for item in new_items:
+                if kind.label(item) not in seen and len(items) < count:
+                    seen.add(kind.label(item))
+                    items.append(item)
+
+        if len(items) == count:
+            self.cache.set(key, json.dumps(items))
+        return items
+
+    def generate(self, kind_name, pages, title, count=10, progress=None, fresh=False):
+        """Up to `count` items of `kind_name` ("mcq" or "flashcards") in book order.
+
+        Each item also carries the "pages" it was written from.
+        `progress(done, total, message)` is called as sections complete and
+        `fresh` ignores cached sections.
+        """
+        kind = KINDS[kind_name]
+        shards = plan_shards(split_sections(pages, self.chunk_tokens), count)
+        results = [None] * len(shards)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="quiz") as pool:
+            futures = {
+                pool.submit(self._section_items, kind, section, n, title, fresh): i
+                for i, (section, n) in enumerate(shards)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                results[i] = future.result()
+                if progress:
+                    section = shards[i][0]
+                    progress(done, len(shards), f"Wrote items for pages {section.first}-{section.last}")
+
+        items, seen = [], set()
+        for (section, _), section_items in zip(shards, results):
+            for item in section_items:
+                if kind.label(item) in seen:
+                    continue
+                seen.add(kind.label(item))
+                pages_label = str(section.first) if section.first == section.last else f"{section.first}-{section.last}"
+                items.append(dict(item, pages=pages_label))
+        return items[:count]
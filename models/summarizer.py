@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from models.backend_pool import NOTES
+from models.llm import generate_text
+from utils.result_cache import make_key
+from utils.tokens import count_tokens
+
+
+MAP_PROMPT = (
+    "Summarize pages {first}-{last} of this book as concise study notes. "
+    "Keep every important concept, definition, fact and example; leave out filler. "
+    "Use plain sentences, no Markdown."
+)
+
+REDUCE_PROMPT = (
+    "These are study notes on consecutive sections (pages {first}-{last}) of this book. "
+    "Merge them into one set of concise study notes that keeps every important concept, "
+    "definition and fact. Use plain sentences, no Markdown."
+)
+
+SECTION_TEMPLATE = "[Pages {first}-{last}]\n{text}"
+
+# Sent as is: the instruction, then the text it applies to
+NOTES_TEMPLATE = "{instruction}\n\nBook: {title}\n\n{text}"
+
+
+class Section:
+    """Text or notes covering a page range (pages are 1-based, inclusive)"""
+
+    def __init__(self, first, last, text):
+        self.first = first
+        self.last = last
+        self.text = text
+
+    def render(self):
+        return SECTION_TEMPLATE.format(first=self.first, last=self.last, text=self.text)
+
+
+def split_sections(pages, max_tokens):
+    """Group consecutive pages into sections of at most ~`max_tokens` each.
+
+    A single page longer than the budget is cut into several sections that
+    share its page number.
+    """
+    max_chars = max_tokens * 4
+    sections, current, first, last, used = [], [], 1, 1, 0
+    for number, text in enumerate(pages, start=1):
+        text = " ".join(text.split())
+        if not text:
+            continue
+        cost = count_tokens(text)
+        if current and used + cost > max_tokens:
+            sections.append(Section(first, last, "\n".join(current)))
+            current, used = [], 0
+        if cost > max_tokens:
+            for start in range(0, len(text), max_chars):
+                sections.append(Section(number, number, text[start:start + max_chars]))
+            continue
+        if not current:
+            first = number
+        current.append(text)
+        last = number
+        used += cost
+    if current:
+        sections.append(Section(first, last, "\n".join(current)))
+    return sections
+
+
+class BookSummarizer:
+    """Whole-book notes by map-reduce over page ranges.
+
+    Map: every section of at most `chunk_tokens` is summarized, up to
+    `concurrency` at a time. Reduce: neighbouring notes are merged level by
+    level until everything fits in one `chunk_tokens` context again. Every
+    partial is stored in `cache` under a key derived from its own input, so a
+    re-run, another feature or a re-upload of the same book only generates
+    what is missing.
+    """
+
+    def __init__(self, cache, model, chunk_tokens=3000, concurrency=2):
+        self.cache = cache
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = max(1, concurrency)
+
+    def _generate(self, prompt, context, title):
+        # The title only labels the text, so it stays out of the key and
+        # re-uploads under another name reuse the notes
+        key = make_key("book-notes", "plain", self.model, prompt, context)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        return generate_text(NOTES_TEMPLATE.format(instruction=prompt, title=title, text=context), NOTES,
+                             cache=self.cache, cache_key=key)
+
+    def _summarize(self, section, title):
+        prompt = MAP_PROMPT.format(first=section.first, last=section.last)
+        return Section(section.first, section.last, self._generate(prompt, section.text, title))
+
+    def _merge(self, group, title):
+        first, last = group[0].first, group[-1].last
+        prompt = REDUCE_PROMPT.format(first=first, last=last)
+        context = "\n\n".join(section.render() for section in group)
+        return Section(first, last, self._generate(prompt, context, title))
+
+    def _groups(self, sections):
+        """Neighbouring sections whose notes fit one context together"""
+        groups, current, used = [], [], 0
+        for section in sections:
+            cost = count_tokens(section.render())
+            if current and used + cost > self.chunk_tokens:
+                groups.append(current)
+                current, used = [], 0
+            current.append(section)
+            used += cost
+        groups.append(current)
+        if len(groups) == len(sections):
+            # Notes too long to combine within the budget: merge in pairs so
+            # every level still shrinks
+            groups = [sections[i:i + 2] for i in range(0, len(sections), 2)]
+        return groups
+
+    def _fits(self, sections):
+        return sum(count_tokens(section.render()) for section in sections) <= self.chunk_tokens
+
+    def notes(self, pages, title, progress=None):
+        """Notes covering every page, as one context string labelled by page range.
+
+        `progress(done, total, message)` is called as partials complete.
+        """
+        sections = split_sections(pages, self.chunk_tokens)
+        if not sections:
+            return ""
+        total = len(sections)
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="summarize") as pool:
+            level = []
+            for section in pool.map(lambda s: self._summarize(s, title), sections):
+                level.append(section)
+                done += 1
+                if progress:
+                    progress(done, total, f"Read pages {section.first}-{section.last}")
+
+            while len(level) > 1 and not self._fits(level):
+                groups = self._groups(level)
+                total += len(groups)
+                merged = []
+                for section in pool.map(lambda g: g[0] if len(g) == 1 else self._merge(g, title), groups):
+                    merged.append(section)
+                    done += 1
+                    if progress:
+                        progress(done, total, f"Combined notes for pages {section.first}-{section.last}")
+                level = merged
+
+        return "\n\n".join(section.render() for section in level)
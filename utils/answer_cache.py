@@ -0,0 +1,108 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+WORD_RE = re.compile(r"\w+")
+
+# Questions that lean on the conversation so far ("explain that again")
+# mean something different in every chat, so they are never cached.
+FOLLOW_UP_WORDS = frozenset("""
+it its this that these those they them he she his her above previous earlier
+more again continue elaborate else same
+""".split())
+
+# MinHash over character 3-grams
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, 1 << 32, NUM_PERMUTATIONS).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, NUM_PERMUTATIONS).astype(np.uint64)
+
+
+def normalize_question(question):
+    """Case-, whitespace- and punctuation-insensitive form of a question"""
+    return " ".join(PUNCTUATION_RE.sub(" ", question.lower()).split())
+
+
+def is_cacheable(normalized):
+    words = WORD_RE.findall(normalized)
+    return bool(words) and not FOLLOW_UP_WORDS.intersection(words)
+
+
+def minhash(text):
+    """MinHash signature of the character 3-grams of `text`"""
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # a * h + b stays below 2**64 because a, h < 2**32
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1)
+
+
+class AnswerCache:
+    """Bounded in-memory cache of chat answers per book.
+
+    Answers are keyed by the book (its content hash, so a changed PDF never
+    matches old answers) and the normalized question. With `similarity`
+    above 0, a question whose MinHash similarity to a cached one reaches
+    that threshold also hits. The least recently used answers are evicted
+    beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries=2000, similarity=0.0):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._entries = OrderedDict()  # (book_key, normalized) -> (signature, answer)
+        self._books = {}  # book_key -> {normalized: signature}
+        self._lock = threading.Lock()
+
+    def get(self, book_key, question):
+        normalized = normalize_question(question)
+        if self.max_entries <= 0 or not is_cacheable(normalized):
+            return None
+        with self._lock:
+            entry = self._entries.get((book_key, normalized))
+            if entry is None and self.similarity > 0:
+                normalized = self._nearest(book_key, normalized)
+                entry = self._entries.get((book_key, normalized)) if normalized else None
+            if entry is None:
+                return None
+            self._entries.move_to_end((book_key, normalized))
+            return entry[1]
+
+    def _nearest(self, book_key, normalized):
+        """Most similar cached question for this book at or above the threshold"""
+        questions = self._books.get(book_key)
+        if not questions:
+            return None
+        keys = list(questions)
+        signatures = np.stack([questions[key] for key in keys])
+        scores = (signatures == minhash(normalized)).mean(axis=1)
+        best = int(scores.argmax())
+        return keys[best] if scores[best] >= self.similarity else None
+
+    def put(self, book_key, question, answer):
+        normalized = normalize_question(question)
+        if self.max_entries <= 0 or not answer or not is_cacheable(normalized):
+            return
+        signature = minhash(normalized) if self.similarity > 0 else None
+        with self._lock:
+            self._entries[(book_key, normalized)] = (signature, answer)
+            self._entries.move_to_end((book_key, normalized))
+            self._books.setdefault(book_key, {})[normalized] = signature
+            while len(self._entries) > self.max_entries:
+                (old_book, old_question), _ = self._entries.popitem(last=False)
+                book = self._books[old_book]
+                del book[old_question]
+                if not book:
+                    del self._books[old_book]
+
+    def invalidate(self, book_key):
+        """Forget every answer for a book"""
+        with self._lock:
+            for normalized in self._books.pop(book_key, {}):
+                del self._entries[(book_key, normalized)]
@@ -0,0 +1,389 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from utils.metrics import STORAGE_EVICTED_BYTES, STORAGE_EVICTIONS
+from utils.sqlite_store import SQLiteStore
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    original_name TEXT NOT NULL,
+    upload_time TEXT NOT NULL,
+    last_accessed TEXT NOT NULL,
+    content_hash TEXT,
+    status TEXT NOT NULL DEFAULT 'ready',
+    PRIMARY KEY (user_id, filename)
+);
+CREATE TABLE IF NOT EXISTS book_texts (
+    content_hash TEXT PRIMARY KEY,
+    pdf_text BLOB NOT NULL,
+    page_ends TEXT,
+    page_count INTEGER,
+    pages_read INTEGER,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_book_texts_access ON book_texts (last_access);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_book ON chat_messages (user_id, filename, id);
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    through_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, filename)
+);
+"""
+
+
+# A ready book whose text was evicted reports status 'evicted'
+BOOK_STATUS = "CASE WHEN b.status = 'ready' AND t.content_hash IS NULL THEN 'evicted' ELSE b.status END AS status"
+
+
+def _now():
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def text_hash(pdf_text):
+    """Key for text stored without the hash of its PDF"""
+    return hashlib.sha256(pdf_text.encode("utf-8")).hexdigest()
+
+
+class BookStore(SQLiteStore):
+    """Server-side storage for extracted book text, metadata and chat history.
+
+    Everything is kept in a single SQLite file so the Flask session only has to
+    carry a user id and the current book's filename. Book text is stored
+    zlib-compressed, once per PDF content hash however many users have the
+    book, and is only loaded when a route actually needs it. With
+    `text_quota` (bytes, 0 = unlimited) the least recently used texts are
+    evicted once the stored texts exceed it; their books report status
+    'evicted' until the text is extracted again.
+    """
+
+    row_factory = sqlite3.Row
+
+    def __init__(self, db_path, text_quota=0):
+        super().__init__(db_path)
+        self.text_quota = text_quota
+        self._evict_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+
+    def _migrate(self, conn):
+        """Add columns introduced after a database was first created"""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(books)")}
+        if "content_hash" not in columns:
+            conn.execute("ALTER TABLE books ADD COLUMN content_hash TEXT")
+        if "status" not in columns:
+            conn.execute("ALTER TABLE books ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'")
+        if "pdf_text" in columns:
+            self._move_texts(conn, columns)
+        # Uploads are shared by content hash across users
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_books_filename ON books (filename)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_books_hash ON books (content_hash)")
+
+    def _move_texts(self, conn, columns):
+        """Move text stored per book (before texts were shared) into book_texts"""
+        page_columns = [name for name in ("page_ends", "page_count", "pages_read") if name in columns]
+        select = ", ".join(["user_id", "filename", "content_hash", "pdf_text"] + page_columns)
+        for row in conn.execute(f"SELECT {select} FROM books WHERE status = 'ready'").fetchall():
+            row = dict(row)
+            content_hash = row["content_hash"] or text_hash(zlib.decompress(row["pdf_text"]).decode("utf-8"))
+            conn.execute(
+                "INSERT INTO book_texts (content_hash, pdf_text, page_ends, page_count, pages_read, size, "
+                "last_access) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (content_hash) DO NOTHING",
+                (content_hash, row["pdf_text"], row.get("page_ends"), row.get("page_count"),
+                 row.get("pages_read"), len(row["pdf_text"]), time.time()),
+            )
+            conn.execute("UPDATE books SET content_hash = ? WHERE user_id = ? AND filename = ?",
+                         (content_hash, row["user_id"], row["filename"]))
+        for name in ["pdf_text"] + page_columns:
+            conn.execute(f"ALTER TABLE books DROP COLUMN {name}")
+
+    # Books
+
+    def add_book(self, user_id, filename, original_name, pdf_text="", upload_time=None,
+                 content_hash=None, status="ready"):
+        """Add a book; use status="processing" when its text is still being extracted"""
+        upload_time = upload_time or _now()
+        if pdf_text:
+            content_hash = content_hash or text_hash(pdf_text)
+            self._store_text(content_hash, pdf_text)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO books "
+                "(user_id, filename, original_name, upload_time, last_accessed, content_hash, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, filename, original_name, upload_time, upload_time, content_hash, status),
+            )
+        self._evict_texts(keep=content_hash)
+
+    def finish_book(self, filename, pdf_text, content_hash=None, status="ready", page_ends=None,
+                    page_count=None):
+        """Store the extracted text for every book (of any user) still processing this upload.
+
+        `page_ends` are the offsets in `pdf_text` where each page ends and
+        `page_count` is the number of pages in the PDF, which is more than
+        were read when extraction stopped at the page limit.
+        """
+        if status == "ready":
+            content_hash = content_hash or text_hash(pdf_text)
+            self._store_text(content_hash, pdf_text, page_ends, page_count)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE books SET content_hash = COALESCE(?, content_hash), status = ? "
+                "WHERE filename = ? AND status = 'processing'",
+                (content_hash, status, filename),
+            )
+        self._evict_texts(keep=content_hash)
+
+    def use_stored_text(self, user_id, filename, content_hash):
+        """Give a book the text already extracted for another copy of the same PDF.
+
+        Returns True if that text is stored and the book is now ready.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE books SET content_hash = ?, status = 'ready' WHERE user_id = ? AND filename = ? "
+                "AND EXISTS (SELECT 1 FROM book_texts WHERE content_hash = ?)",
+                (content_hash, user_id, filename, content_hash),
+            )
+            conn.execute("UPDATE book_texts SET last_access = ? WHERE content_hash = ?", (time.time(), content_hash))
+        return cursor.rowcount > 0
+
+    def reprocess(self, filename):
+        """Mark the ready books of an upload whose text was evicted as processing again"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE books SET status = 'processing' WHERE filename = ? AND status = 'ready' "
+                "AND NOT EXISTS (SELECT 1 FROM book_texts t WHERE t.content_hash = books.content_hash)",
+                (filename,),
+            )
+
+    def set_status(self, user_id, filename, status):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE books SET status = ? WHERE user_id = ? AND filename = ?",
+                (status, user_id, filename),
+            )
+
+    def count_references(self, filename, status=None):
+        """Number of books, across all users, stored under this upload filename
+        (only those with `status` if given)"""
+        if status is None:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM books WHERE filename = ?", (filename,)
+            ).fetchone()[0]
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM books WHERE filename = ? AND status = ?", (filename, status)
+        ).fetchone()[0]
+
+    def set_content_hash(self, user_id, filename, content_hash):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE books SET content_hash = ? WHERE user_id = ? AND filename = ?",
+                (content_hash, user_id, filename),
+            )
+
+    def get_book(self, user_id, filename):
+        """Book metadata (without text) or None"""
+        if not filename:
+            return None
+        row = self._connect().execute(
+            f"SELECT b.filename, b.original_name, b.upload_time, b.last_accessed, b.content_hash, {BOOK_STATUS}, "
+            "t.page_count, t.pages_read, "
+            "(SELECT COUNT(*) FROM chat_messages m "
+            " WHERE m.user_id = b.user_id AND m.filename = b.filename) AS chat_count "
+            "FROM books b LEFT JOIN book_texts t ON t.content_hash = b.content_hash "
+            "WHERE b.user_id = ? AND b.filename = ?",
+            (user_id, filename),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _load_text(self, user_id, filename):
+        """The stored text row of a book, marked as used now; None if it has none"""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT t.content_hash, t.pdf_text, t.page_ends FROM books b "
+            "JOIN book_texts t ON t.content_hash = b.content_hash WHERE b.user_id = ? AND b.filename = ?",
+            (user_id, filename),
+        ).fetchone()
+        if row:
+            with conn:
+                conn.execute("UPDATE book_texts SET last_access = ? WHERE content_hash = ?",
+                             (time.time(), row["content_hash"]))
+        return row
+
+    def get_text(self, user_id, filename):
+        row = self._load_text(user_id, filename)
+        if not row:
+            return ""
+        return zlib.decompress(row["pdf_text"]).decode("utf-8")
+
+    def get_pages(self, user_id, filename):
+        """The book's text split into pages (one piece for books stored without page offsets)"""
+        row = self._load_text(user_id, filename)
+        if not row:
+            return []
+        text = zlib.decompress(row["pdf_text"]).decode("utf-8")
+        if not row["page_ends"]:
+            return [text] if text else []
+        pages, start = [], 0
+        for end in json.loads(row["page_ends"]):
+            pages.append(text[start:end])
+            start = end
+        return pages
+
+    def list_books(self, user_id):
+        """All of a user's books as {filename: metadata}, most recently used first"""
+        rows = self._connect().execute(
+            f"SELECT b.filename, b.original_name, b.upload_time, b.last_accessed, b.content_hash, {BOOK_STATUS}, "
+            "(SELECT COUNT(*) FROM chat_messages m "
+            " WHERE m.user_id = b.user_id AND m.filename = b.filename) AS chat_count "
+            "FROM books b LEFT JOIN book_texts t ON t.content_hash = b.content_hash "
+            "WHERE b.user_id = ? ORDER BY b.last_accessed DESC",
+            (user_id,),
+        ).fetchall()
+        return {row["filename"]: dict(row) for row in rows}
+
+    def touch(self, user_id, filename):
+        """Mark a book, and the text it uses, as opened now"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE books SET last_accessed = ? WHERE user_id = ? AND filename = ?",
+                (_now(), user_id, filename),
+            )
+            conn.execute(
+                "UPDATE book_texts SET last_access = ? WHERE content_hash = "
+                "(SELECT content_hash FROM books WHERE user_id = ? AND filename = ?)",
+                (time.time(), user_id, filename),
+            )
+
+    def delete_book(self, user_id, filename):
+        """Delete a book and its chats; its text goes with the last book using it"""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM book_texts WHERE content_hash = "
+                "(SELECT content_hash FROM books WHERE user_id = ? AND filename = ?) "
+                "AND (SELECT COUNT(*) FROM books WHERE content_hash = book_texts.content_hash) = 1",
+                (user_id, filename),
+            )
+            conn.execute("DELETE FROM books WHERE user_id = ? AND filename = ?", (user_id, filename))
+            conn.execute("DELETE FROM chat_messages WHERE user_id = ? AND filename = ?", (user_id, filename))
+            conn.execute("DELETE FROM chat_summaries WHERE user_id = ? AND filename = ?", (user_id, filename))
+
+    # Book texts
+
+    def _store_text(self, content_hash, pdf_text, page_ends=None, page_count=None):
+        data = zlib.compress(pdf_text.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO book_texts "
+                "(content_hash, pdf_text, page_ends, page_count, pages_read, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, data, json.dumps(page_ends) if page_ends is not None else None, page_count,
+                 len(page_ends) if page_ends is not None else None, len(data), time.time()),
+            )
+
+    def text_usage(self):
+        """{"files", "bytes", "quota"} of the stored texts, like StorageManager.usage()"""
+        count, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM book_texts").fetchone()
+        return {"files": count, "bytes": size, "quota": self.text_quota}
+
+    def _evict_texts(self, keep=None):
+        """Drop least recently used texts (never `keep`, the one just stored) until they fit in text_quota"""
+        if self.text_quota <= 0:
+            return
+        with self._evict_lock, self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM book_texts").fetchone()[0]
+            if total <= self.text_quota:
+                return
+            rows = conn.execute(
+                "SELECT content_hash, size FROM book_texts WHERE content_hash IS NOT ? ORDER BY last_access",
+                (keep,),
+            ).fetchall()
+            doomed = []
+            for content_hash, size in rows:
+                if total <= self.text_quota:
+                    break
+                doomed.append((content_hash,))
+                total -= size
+                STORAGE_EVICTIONS.inc(category="texts")
+                STORAGE_EVICTED_BYTES.inc(size, category="texts")
+            conn.executemany("DELETE FROM book_texts WHERE content_hash = ?", doomed)
+
+    # Chat history
+
+    def add_message(self, user_id, filename, question, answer):
+        """Store one exchange and return its message id"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO chat_messages (user_id, filename, question, answer) VALUES (?, ?, ?, ?)",
+                (user_id, filename, question, answer),
+            )
+            return cursor.lastrowid
+
+    def get_chat_history(self, user_id, filename, limit=None, before_id=None):
+        """Chat messages in order; with `limit` only the most recent ones
+        (before message `before_id`, when given)"""
+        query = "SELECT id, question, answer FROM chat_messages WHERE user_id = ? AND filename = ?"
+        params = [user_id, filename]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._connect().execute(query, params).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def get_messages_after(self, user_id, filename, after_id):
+        """Chat messages newer than message `after_id`, oldest first"""
+        rows = self._connect().execute(
+            "SELECT id, question, answer FROM chat_messages WHERE user_id = ? AND filename = ? AND id > ? ORDER BY id",
+            (user_id, filename, after_id),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_chat_summary(self, user_id, filename):
+        """(running summary, id of the last message it covers); ("", 0) if none"""
+        row = self._connect().execute(
+            "SELECT summary, through_id FROM chat_summaries WHERE user_id = ? AND filename = ?",
+            (user_id, filename),
+        ).fetchone()
+        return (row["summary"], row["through_id"]) if row else ("", 0)
+
+    def set_chat_summary(self, user_id, filename, summary, through_id):
+        """Store a running summary, unless the chat was cleared or a newer summary exists"""
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT INTO chat_summaries (user_id, filename, summary, through_id)
+                   SELECT ?, ?, ?, ? WHERE EXISTS (
+                       SELECT 1 FROM chat_messages WHERE id = ? AND user_id = ? AND filename = ?)
+                   ON CONFLICT (user_id, filename) DO UPDATE SET
+                       summary = excluded.summary, through_id = excluded.through_id
+                   WHERE excluded.through_id > chat_summaries.through_id""",
+                (user_id, filename, summary, through_id, through_id, user_id, filename),
+            )
+
+    def clear_chat(self, user_id, filename):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chat_messages WHERE user_id = ? AND filename = ?", (user_id, filename))
+            conn.execute("DELETE FROM chat_summaries WHERE user_id = ? AND filename = ?", (user_id, filename))
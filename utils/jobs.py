@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """A unit of background work with progress reporting"""
+
+    def __init__(self, kind, key=None, owner=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.owner = owner
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        # Partial state a running job shares with request handlers
+        self.meta = {}
+        self.created = time.time()
+        self.updated = self.created
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def update(self, progress=None, message=None):
+        """Called from inside the job function to report progress (0.0 - 1.0)"""
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+        self.updated = time.time()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress * 100),
+            "message": self.message,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """In-process job queue on top of a thread pool.
+
+    Jobs submitted with the same `key` while one is still queued or running
+    share that job instead of doing the work twice. Finished jobs are kept for
+    `retention` seconds so clients can fetch their status and result.
+    """
+
+    def __init__(self, max_workers=4, retention=3600):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._active_keys = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, key=None, owner=None, **kwargs):
+        """Run `fn(job, *args, **kwargs)` in the background and return the Job"""
+        with self._lock:
+            self._prune()
+            if key is not None and key in self._active_keys:
+                return self._jobs[self._active_keys[key]]
+            job = Job(kind, key=key, owner=owner)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_keys[key] = job.id
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        job.update()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.update()
+            with self._lock:
+                if job.key is not None and self._active_keys.get(job.key) == job.id:
+                    del self._active_keys[job.key]
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.updated < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
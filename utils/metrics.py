@@ -0,0 +1,288 @@
+"""In-process metrics: counters, histograms and timing spans.
+
+Everything is kept in memory for this process and rendered in the Prometheus
+text format by /metrics. `span(stage)` times a block into the
+``studymate_stage_seconds`` histogram and, while a request is being profiled,
+into that request's timing breakdown as well.
+"""
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a fast SQLite read up to a long generation
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(list(zip(self.labelnames, key)), value))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_series(self, labels, value):
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _render_series(self, labels, state):
+        counts, total, count = state
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            bucket_labels = labels + [("le", _format_value(float(bound)))]
+            lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Named collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "studymate_http_requests_total", "HTTP requests by route and status", ("endpoint", "method", "status"))
+HTTP_SECONDS = registry.histogram(
+    "studymate_http_request_seconds", "Time until the response starts (streamed bodies excluded)", ("endpoint",))
+STAGE_SECONDS = registry.histogram(
+    "studymate_stage_seconds", "Time spent in each stage of request handling", ("stage",))
+PDF_PAGES = registry.counter(
+    "studymate_pdf_pages_extracted_total", "PDF pages whose text was extracted")
+PDF_BYTES = registry.counter(
+    "studymate_pdf_text_bytes_extracted_total", "UTF-8 bytes of text extracted from PDFs")
+PROMPT_CHARS = registry.histogram(
+    "studymate_prompt_chars", "Characters per prompt sent to the model", (),
+    (1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+PROMPT_TOKENS = registry.histogram(
+    "studymate_prompt_tokens", "Estimated tokens per prompt sent to the model", (),
+    (256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "studymate_llm_time_to_first_token_seconds", "Time from request to first generated token, queueing included",
+    ("mode",))
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "studymate_llm_tokens_per_second", "Generation rate after the first token", ("mode",),
+    (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250))
+LLM_TOKENS = registry.counter(
+    "studymate_llm_tokens_total", "Tokens (stream chunks) received from the model", ("mode",))
+LLM_COALESCED = registry.counter(
+    "studymate_llm_coalesced_total", "Requests served by joining an identical in-flight generation", ("mode",))
+LLM_ERRORS = registry.counter(
+    "studymate_llm_errors_total", "Generations that failed", ("mode",))
+LLM_BACKEND_REQUESTS = registry.counter(
+    "studymate_llm_backend_requests_total", "Generations sent to each Ollama backend", ("backend", "job"))
+LLM_BACKEND_EJECTIONS = registry.counter(
+    "studymate_llm_backend_ejections_total", "Times an Ollama backend was taken out of rotation", ("backend",))
+QUIZ_ITEMS = registry.counter(
+    "studymate_quiz_items_total", "Generated quiz items by kind and validation outcome", ("kind", "outcome"))
+TTS_SECONDS = registry.histogram(
+    "studymate_tts_synthesis_seconds", "Wall time to synthesize one narration", ("backend",))
+TTS_SEGMENTS = registry.counter(
+    "studymate_tts_segments_total", "Audio segments synthesized", ("backend",))
+CACHE_REQUESTS = registry.counter(
+    "studymate_cache_requests_total", "Cache lookups by cache and outcome", ("cache", "result"))
+STORAGE_EVICTIONS = registry.counter(
+    "studymate_storage_evictions_total", "Files removed to keep a storage category within its quota", ("category",))
+STORAGE_EVICTED_BYTES = registry.counter(
+    "studymate_storage_evicted_bytes_total", "Bytes freed by storage evictions", ("category",))
+
+
+# Per-request timing breakdown, only collected while a request is profiled
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing(timings, total):
+    """Server-Timing header value for a timing breakdown"""
+    entries = [f"{stage};dur={elapsed * 1000:.2f}" for stage, elapsed in timings]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class RequestMetricsMiddleware:
+    """WSGI middleware that counts and times every request.
+
+    The route label comes from ``environ["studymate.endpoint"]``, set by the
+    app once Flask has matched the URL, so it stays low-cardinality.
+
+    With `profile_dir` set, ``?profile=timing`` adds a Server-Timing header
+    listing every span of that request and ``?profile=cprofile`` also writes
+    a cProfile dump to `profile_dir` and logs its top functions. Streamed
+    bodies are produced after the handler returns and are not included.
+    """
+
+    def __init__(self, wsgi_app, profile_dir=None):
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+
+    def _profile_mode(self, environ):
+        if not self.profile_dir:
+            return None
+        mode = parse_qs(environ.get("QUERY_STRING", "")).get("profile", [None])[0]
+        return mode if mode in ("timing", "cprofile") else None
+
+    def __call__(self, environ, start_response):
+        mode = self._profile_mode(environ)
+        timings = [] if mode else None
+        token = _timings.set(timings)
+        profiler = cProfile.Profile() if mode == "cprofile" else None
+        started = time.perf_counter()
+
+        def record_start(status, headers, exc_info=None):
+            elapsed = time.perf_counter() - started
+            endpoint = environ.get("studymate.endpoint", "unmatched")
+            HTTP_REQUESTS.inc(endpoint=endpoint, method=environ.get("REQUEST_METHOD", ""),
+                              status=status.split(" ", 1)[0])
+            HTTP_SECONDS.observe(elapsed, endpoint=endpoint)
+            if timings is not None:
+                headers = list(headers) + [("Server-Timing", server_timing(timings, elapsed))]
+            return start_response(status, headers, exc_info)
+
+        try:
+            if profiler:
+                profiler.enable()
+            try:
+                return self.wsgi_app(environ, record_start)
+            finally:
+                if profiler:
+                    profiler.disable()
+                    self._dump_profile(profiler, environ)
+        finally:
+            _timings.reset(token)
+
+    def _dump_profile(self, profiler, environ):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = environ.get("PATH_INFO", "/").strip("/").replace("/", "_") or "index"
+        filename = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{path}.prof")
+        profiler.dump_stats(filename)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(20)
+        logger.info("Profile of %s written to %s\n%s", environ.get("PATH_INFO"), filename, summary.getvalue())
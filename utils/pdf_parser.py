@@ -1,13 +1,90 @@
-import fitz  # PyMuPDF
-
-def extract_text_from_pdf(pdf_path, max_pages=100):
-    text = ""
-    try:
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                if page.number >= max_pages:  # Safety limit
-                    break
-                text += page.get_text()
-    except Exception as e:
-        print(f"Error reading PDF: {e}")
-    return text
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# PyMuPDF is imported on first use, so processes that never read a PDF
+# (chat-only workers) don't pay for loading it
+
+# Books with at least this many pages are extracted in parallel
+PARALLEL_MIN_PAGES = 64
+# Pages handed to a worker process at a time
+PAGES_PER_TASK = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PdfExtractionError(Exception):
+    """Raised when a PDF cannot be opened or read"""
+
+
+def _get_pool(workers):
+    """Shared worker pool, created on first use and reused across uploads"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver avoids forking the threaded web process itself
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def _extract_range(pdf_path, start, end):
+    """Worker: text of pages [start, end) of a PDF"""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return [doc[number].get_text() for number in range(start, end)]
+
+
+class PdfPages:
+    """Page-by-page text of a PDF.
+
+    Iterating yields one record per page, in order:
+    ``{"page": 1-based number, "text": str, "start": offset, "end": offset}``
+    where the offsets locate the page inside the concatenated book text.
+    `page_count` and `truncated` are known as soon as the object is created.
+    """
+
+    def __init__(self, pdf_path, max_pages=None, workers=None):
+        self.pdf_path = pdf_path
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        import fitz
+        try:
+            with fitz.open(pdf_path) as doc:
+                self.page_count = doc.page_count
+        except Exception as e:
+            raise PdfExtractionError(f"Cannot open {pdf_path}: {e}") from e
+        self.pages_to_extract = min(self.page_count, max_pages) if max_pages else self.page_count
+
+    @property
+    def truncated(self):
+        return self.pages_to_extract < self.page_count
+
+    def _page_texts(self):
+        if self.workers > 1 and self.pages_to_extract >= PARALLEL_MIN_PAGES:
+            ranges = [
+                (start, min(start + PAGES_PER_TASK, self.pages_to_extract))
+                for start in range(0, self.pages_to_extract, PAGES_PER_TASK)
+            ]
+            pool = _get_pool(self.workers)
+            # map() returns batches in submission order while workers run ahead
+            batches = pool.map(_extract_range, *zip(*[(self.pdf_path, s, e) for s, e in ranges]))
+            for batch in batches:
+                yield from batch
+        else:
+            import fitz
+            with fitz.open(self.pdf_path) as doc:
+                for number in range(self.pages_to_extract):
+                    yield doc[number].get_text()
+
+    def __iter__(self):
+        offset = 0
+        try:
+            for number, text in enumerate(self._page_texts(), start=1):
+                yield {"page": number, "text": text, "start": offset, "end": offset + len(text)}
+                offset += len(text)
+        except PdfExtractionError:
+            raise
+        except Exception as e:
+            raise PdfExtractionError(f"Error reading {self.pdf_path}: {e}") from e
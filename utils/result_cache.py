@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+
+from utils.metrics import CACHE_REQUESTS
+from utils.sqlite_store import SQLiteStore
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_access ON results (last_access);
+"""
+
+
+def make_key(*parts):
+    """Stable cache key from strings such as (content hash, prompt template, model)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache(SQLiteStore):
+    """Persistent LRU cache for expensive LLM results.
+
+    Entries live in SQLite and are evicted least-recently-used first once the
+    stored values exceed `max_bytes`. With `ttl` set, entries older than that
+    many seconds are treated as missing. Lookups are counted in the metrics
+    under `name`.
+    """
+
+    def __init__(self, db_path, max_bytes, ttl=None, name="results"):
+        super().__init__(db_path)
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._evict_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def get(self, key):
+        value = self._get(key)
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def _get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl and now - row[1] > self.ttl:
+            with conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+        return row[0].decode("utf-8")
+
+    def set(self, key, value):
+        data = value.encode("utf-8")
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+        self._evict()
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        with self._evict_lock, self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute("SELECT key, size FROM results ORDER BY last_access").fetchall()
+            doomed = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM results WHERE key = ?", doomed)
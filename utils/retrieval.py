@@ -0,0 +1,196 @@
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it
+its me my of on or so than that the their them then there these they this to
+was we were what when where which who why will with you your
+""".split())
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+INDEX_SUFFIX = ".index.npz"
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_pages(pages, chunk_chars=1200, overlap=150):
+    """Split page texts into (page_number, text) chunks that never cross a page boundary"""
+    chunks = []
+    for page_number, page_text in enumerate(pages, start=1):
+        text = " ".join(page_text.split())
+        start = 0
+        while start < len(text):
+            end = min(len(text), start + chunk_chars)
+            if end < len(text):
+                # Break on a word boundary when possible
+                space = text.rfind(" ", start + chunk_chars // 2, end)
+                if space != -1:
+                    end = space
+            chunks.append((page_number, text[start:end]))
+            if end >= len(text):
+                break
+            start = max(end - overlap, start + 1)
+    return chunks
+
+
+class BookIndex:
+    """BM25 index over the page-tagged chunks of a single book.
+
+    Postings are stored term-major (CSC style) with the BM25 weight of every
+    (term, chunk) pair precomputed at build time, so a query is just one
+    vectorized scatter-add per query term followed by a partial sort.
+    """
+
+    def __init__(self, terms, term_ptr, post_chunks, post_weights, chunk_pages, chunk_offsets, chunk_data):
+        self.terms = terms
+        self.term_ptr = term_ptr
+        self.post_chunks = post_chunks
+        self.post_weights = post_weights
+        self.chunk_pages = chunk_pages
+        self.chunk_offsets = chunk_offsets
+        self.chunk_data = chunk_data
+        self.term_ids = {term: i for i, term in enumerate(terms.tolist())}
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_pages)
+
+    @classmethod
+    def build(cls, pages):
+        chunks = chunk_pages(pages)
+        vocab = {}
+        term_ids, chunk_ids, freqs = [], [], []
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+
+        for chunk_id, (_, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            lengths[chunk_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                chunk_ids.append(chunk_id)
+                freqs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int32)
+        freqs = np.asarray(freqs, dtype=np.float32)
+
+        # Precompute BM25 weights for every posting
+        n = max(len(chunks), 1)
+        doc_freq = np.bincount(term_ids, minlength=len(vocab)).astype(np.float32)
+        idf = np.log1p((n - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_len = float(lengths.mean()) if len(chunks) else 1.0
+        norm = K1 * (1 - B + B * lengths[chunk_ids] / max(avg_len, 1.0))
+        weights = idf[term_ids] * freqs * (K1 + 1) / (freqs + norm)
+
+        order = np.argsort(term_ids, kind="stable")
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(doc_freq.astype(np.int64), out=term_ptr[1:])
+
+        encoded = [text.encode("utf-8") for _, text in chunks]
+        chunk_offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=chunk_offsets[1:])
+
+        terms = np.array(sorted(vocab, key=vocab.get), dtype=str)
+        return cls(
+            terms=terms,
+            term_ptr=term_ptr,
+            post_chunks=chunk_ids[order],
+            post_weights=weights[order].astype(np.float32),
+            chunk_pages=np.array([page for page, _ in chunks], dtype=np.int32),
+            chunk_offsets=chunk_offsets,
+            chunk_data=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        )
+
+    def save(self, path):
+        # Write to a temp file first so a concurrent reader never sees a partial index
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                terms=self.terms,
+                term_ptr=self.term_ptr,
+                post_chunks=self.post_chunks,
+                post_weights=self.post_weights,
+                chunk_pages=self.chunk_pages,
+                chunk_offsets=self.chunk_offsets,
+                chunk_data=self.chunk_data,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def chunk_text(self, chunk_id):
+        start, end = self.chunk_offsets[chunk_id], self.chunk_offsets[chunk_id + 1]
+        return self.chunk_data[start:end].tobytes().decode("utf-8")
+
+    def search(self, query, top_k=10):
+        """Return [(chunk_id, score)] for the best matching chunks"""
+        scores = np.zeros(self.num_chunks, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            # A term appears at most once per chunk, so plain fancy-index add is safe
+            scores[self.post_chunks[start:end]] += self.post_weights[start:end]
+
+        top_k = min(top_k, self.num_chunks)
+        if top_k == 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+    def ranked_chunks(self, query, top_k=8):
+        """Best matching chunks as [{"page", "text", "score"}], most relevant first.
+
+        Falls back to the opening chunks of the book when nothing matches
+        (e.g. a general question like "summarize this").
+        """
+        hits = self.search(query, top_k)
+        if not hits:
+            hits = [(i, 0.0) for i in range(min(top_k, self.num_chunks))]
+        return [
+            {"page": int(self.chunk_pages[i]), "text": self.chunk_text(i), "score": score}
+            for i, score in hits
+        ]
+
+
+def index_path_for(pdf_path):
+    return pdf_path + INDEX_SUFFIX
+
+
+def build_index(pdf_path, pages):
+    """Build and persist the index for an uploaded PDF"""
+    index = BookIndex.build(pages)
+    index.save(index_path_for(pdf_path))
+    return index
+
+
+@lru_cache(maxsize=32)
+def _load_cached(path, mtime):
+    return BookIndex.load(path)
+
+
+def load_index(pdf_path):
+    """Load a book's index (cached in memory), or None if it was never built"""
+    path = index_path_for(pdf_path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    return _load_cached(path, mtime)
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+
+
+class Flight:
+    """One in-progress generation that any number of subscribers follow.
+
+    The producer calls `publish` for every token and `finish` once at the
+    end. Each subscriber iterates `follow()` (threads) or `afollow()`
+    (asyncio) and receives every token from the first one, however late it
+    joined. When the last subscriber leaves before the end the flight is
+    abandoned, so the producer can stop the upstream work.
+    """
+
+    def __init__(self, on_abandon=None):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.abandoned = False
+        self.subscribers = 0
+        self.cancel = None  # optional hook the producer sets to stop itself promptly
+        self._on_abandon = on_abandon
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    @property
+    def text(self):
+        with self._cond:
+            return "".join(self.tokens)
+
+    def subscribe(self):
+        """Register a subscriber; False if the flight was already abandoned"""
+        with self._cond:
+            if self.abandoned:
+                return False
+            self.subscribers += 1
+            return True
+
+    def _unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+            abandon = self.subscribers == 0 and not self.done
+            if abandon:
+                self.abandoned = True
+        if abandon:
+            if self._on_abandon:
+                self._on_abandon()
+            if self.cancel:
+                self.cancel()
+
+    def _wake(self):
+        # Called with self._cond held
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def publish(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._wake()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def follow(self):
+        """Blocking iterator over every token; re-raises the producer's error"""
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.tokens) and not self.done:
+                        self._cond.wait()
+                    tokens, done, error = self.tokens[index:], self.done, self.error
+                index += len(tokens)
+                yield from tokens
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._unsubscribe()
+
+    async def afollow(self):
+        """asyncio counterpart of `follow`"""
+        loop = asyncio.get_running_loop()
+        index = 0
+        try:
+            while True:
+                event = asyncio.Event()
+                with self._cond:
+                    tokens, done, error = self.tokens[index:], self.done, self.error
+                    if not tokens and not done:
+                        self._async_waiters.append((loop, event))
+                index += len(tokens)
+                for token in tokens:
+                    yield token
+                if tokens:
+                    continue
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+                await event.wait()
+        finally:
+            self._unsubscribe()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical work onto one `Flight` per key.
+
+    `join(key)` returns ``(flight, leader)``. Only the leader starts the
+    producer; everyone, the leader included, consumes the flight. Finished
+    and abandoned flights are forgotten, so the next request for the key
+    starts fresh (typically after a cache lookup).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.subscribe():
+                return flight, False
+            flight = Flight(on_abandon=lambda: self.forget(key, flight))
+            flight.subscribe()
+            self._flights[key] = flight
+            return flight, True
+
+    def forget(self, key, flight):
+        """Stop routing new requests for `key` to `flight`"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
@@ -0,0 +1,33 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """Base for the stores kept in one SQLite file.
+
+    Every thread gets its own connection in WAL mode, so readers never wait
+    for a writer. Subclasses set `row_factory` if they want rows other than
+    tuples.
+    """
+
+    row_factory = None
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
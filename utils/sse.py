@@ -0,0 +1,9 @@
+import json
+
+
+def sse_event(data, event=None):
+    """Encode one server-sent event; `data` is JSON-encoded so newlines survive"""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message.encode("utf-8")
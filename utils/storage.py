@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import STORAGE_EVICTED_BYTES, STORAGE_EVICTIONS
+from utils.sqlite_store import SQLiteStore
+
+
+logger = logging.getLogger(__name__)
+
+# Running totals per category are kept by triggers, so reading them never
+# scans the file list and concurrent writers (threads or processes) agree
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_access ON files (category, last_access);
+CREATE TABLE IF NOT EXISTS usage (
+    category TEXT PRIMARY KEY,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scanned_folders (
+    category TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    PRIMARY KEY (category, folder)
+);
+CREATE TRIGGER IF NOT EXISTS files_added AFTER INSERT ON files BEGIN
+    INSERT INTO usage (category, files, bytes) VALUES (NEW.category, 1, NEW.size)
+        ON CONFLICT (category) DO UPDATE SET files = files + 1, bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS files_removed AFTER DELETE ON files BEGIN
+    UPDATE usage SET files = files - 1, bytes = bytes - OLD.size WHERE category = OLD.category;
+END;
+CREATE TRIGGER IF NOT EXISTS files_changed AFTER UPDATE OF category, size ON files BEGIN
+    UPDATE usage SET files = files - 1, bytes = bytes - OLD.size WHERE category = OLD.category;
+    INSERT INTO usage (category, files, bytes) VALUES (NEW.category, 1, NEW.size)
+        ON CONFLICT (category) DO UPDATE SET files = files + 1, bytes = bytes + NEW.size;
+END;
+"""
+
+
+def remove_file(path):
+    """Default eviction: delete the file (already gone counts as removed)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+class StorageCategory:
+    """Files of one kind sharing a byte quota (0 = unlimited)"""
+
+    def __init__(self, name, quota, folder=None, match=None, evict=None):
+        self.name = name
+        self.quota = quota
+        self.folder = folder
+        self.match = match or (lambda name: True)
+        self.evict = evict or remove_file
+
+
+class StorageManager(SQLiteStore):
+    """Byte quotas with least-recently-used eviction for the files the app writes.
+
+    Files are recorded in an SQLite index (path, category, size, last access)
+    when they are written and touched when they are used, so enforcing a
+    quota never lists a folder: a sweep reads each category's running total
+    and removes that category's least recently used files, at most `batch`
+    per sweep, until it is back under quota. `start` runs sweeps in a
+    background thread, soon after a write and otherwise every `interval`
+    seconds.
+
+    A category's `evict(path)` removes the file and whatever depends on it,
+    and returns False to keep a file that is still in use. A category's
+    `folder` is listed once, the first time the manager runs against it, to
+    index files written before the manager existed.
+    """
+
+    def __init__(self, db_path, batch=100):
+        super().__init__(db_path)
+        self.batch = batch
+        self.categories = {}
+        self._sweep_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def add_category(self, name, quota, folder=None, match=None, evict=None):
+        """Manage files of category `name`; `match(filename)` picks the ones in `folder`"""
+        self.categories[name] = StorageCategory(name, quota, folder, match, evict)
+
+    # Recording files
+
+    def record(self, path, category, last_access=None):
+        """Index a file that was just written (or rewritten) as used now"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            self.forget(path)
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO files (path, category, size, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET category = excluded.category, size = excluded.size, "
+                "last_access = excluded.last_access",
+                (os.path.normpath(path), category, size, last_access or time.time()),
+            )
+        self._wake.set()
+
+    def touch(self, *paths):
+        """Mark files as used now, so they are evicted last"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("UPDATE files SET last_access = ? WHERE path = ?",
+                             [(now, os.path.normpath(path)) for path in paths])
+
+    def forget(self, *paths):
+        """Drop files that were deleted from the index"""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM files WHERE path = ?", [(os.path.normpath(path),) for path in paths])
+
+    def backfill(self, category):
+        """Index the files already in a category's folder; runs once per folder"""
+        spec = self.categories[category]
+        if not spec.folder or not os.path.isdir(spec.folder):
+            return 0
+        conn = self._connect()
+        folder = os.path.normpath(spec.folder)
+        if conn.execute("SELECT 1 FROM scanned_folders WHERE category = ? AND folder = ?",
+                        (category, folder)).fetchone():
+            return 0
+        rows = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # Dot files are uploads still being spooled
+                if entry.is_file() and not entry.name.startswith(".") and spec.match(entry.name):
+                    stat = entry.stat()
+                    rows.append((os.path.normpath(entry.path), category, stat.st_size, stat.st_mtime))
+        with conn:
+            conn.executemany(
+                "INSERT INTO files (path, category, size, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (path) DO NOTHING", rows)
+            conn.execute("INSERT INTO scanned_folders (category, folder) VALUES (?, ?)", (category, folder))
+        return len(rows)
+
+    # Quotas
+
+    def usage(self):
+        """{category: {"files", "bytes", "quota"}} for every managed category"""
+        totals = {row[0]: (row[1], row[2]) for row in self._connect().execute(
+            "SELECT category, files, bytes FROM usage")}
+        return {
+            name: {"files": totals.get(name, (0, 0))[0], "bytes": totals.get(name, (0, 0))[1],
+                   "quota": spec.quota}
+            for name, spec in self.categories.items()
+        }
+
+    def sweep(self):
+        """Evict least recently used files from categories over quota; returns how many went"""
+        evicted = 0
+        with self._sweep_lock:
+            for spec in self.categories.values():
+                if spec.quota > 0:
+                    evicted += self._sweep_category(spec)
+        return evicted
+
+    def _sweep_category(self, spec):
+        conn = self._connect()
+        row = conn.execute("SELECT bytes FROM usage WHERE category = ?", (spec.name,)).fetchone()
+        excess = (row[0] if row else 0) - spec.quota
+        if excess <= 0:
+            return 0
+        oldest = conn.execute(
+            "SELECT path, size FROM files WHERE category = ? ORDER BY last_access LIMIT ?",
+            (spec.name, self.batch),
+        ).fetchall()
+        evicted = 0
+        for path, size in oldest:
+            if excess <= 0:
+                break
+            try:
+                removed = spec.evict(path)
+            except Exception:
+                logger.exception("Evicting %s failed", path)
+                removed = False
+            if not removed:
+                # Still in use: move it to the back of the queue
+                self.touch(path)
+                continue
+            self.forget(path)
+            excess -= size
+            evicted += 1
+            STORAGE_EVICTIONS.inc(category=spec.name)
+            STORAGE_EVICTED_BYTES.inc(size, category=spec.name)
+        if evicted:
+            logger.info("Evicted %d %s file(s) to stay within %d bytes", evicted, spec.name, spec.quota)
+        if evicted and excess > 0:
+            # Over quota still; continue in the next sweep without waiting
+            self._wake.set()
+        return evicted
+
+    def start(self, interval=60.0):
+        """Backfill and sweep in a background thread"""
+        if self._thread:
+            return
+
+        def run():
+            for name in self.categories:
+                try:
+                    count = self.backfill(name)
+                    if count:
+                        logger.info("Indexed %d existing %s file(s)", count, name)
+                except Exception:
+                    logger.exception("Indexing existing %s files failed", name)
+            while True:
+                self._wake.clear()
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("Storage sweep failed")
+                self._wake.wait(interval)
+
+        self._thread = threading.Thread(target=run, name="storage-sweep", daemon=True)
+        self._thread.start()
@@ -0,0 +1,29 @@
+import re
+
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """Fast local estimate of how many model tokens `text` uses.
+
+    Takes the larger of ~4 characters per token and one token per word or
+    punctuation mark, which tracks BPE tokenizers closely enough for
+    budgeting without loading the model's vocabulary.
+    """
+    if not text:
+        return 0
+    return max(len(text) // 4, len(WORD_RE.findall(text)))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` (at a word boundary) so it fits in `max_tokens`"""
+    if max_tokens <= 0:
+        return ""
+    tokens = count_tokens(text)
+    while tokens > max_tokens:
+        cut = int(len(text) * max_tokens / tokens * 0.95)
+        space = text.rfind(" ", 0, cut)
+        text = text[:space if space > cut // 2 else cut]
+        tokens = count_tokens(text)
+    return text
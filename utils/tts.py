@@ -0,0 +1,160 @@
+import asyncio
+import io
+import math
+import re
+import threading
+
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+
+def split_segments(text, max_chars=400):
+    """Split narration text into segments on paragraph and sentence boundaries.
+
+    Consecutive short sentences are packed together up to `max_chars` so each
+    segment is a reasonably sized synthesis request.
+    """
+    segments = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        current = ""
+        for sentence in SENTENCE_END_RE.split(" ".join(paragraph.split())):
+            if not sentence:
+                continue
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                segments.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            segments.append(current)
+    return segments
+
+
+class EdgeTTSBackend:
+    """Microsoft Edge online voices (needs network access)"""
+
+    name = "edge"
+
+    async def synthesize(self, text, voice):
+        import edge_tts
+
+        audio = bytearray()
+        async for chunk in edge_tts.Communicate(text=text, voice=voice).stream():
+            if chunk["type"] == "audio":
+                audio.extend(chunk["data"])
+        return bytes(audio)
+
+
+class GTTSBackend:
+    """Google Translate TTS; the voice only selects the language and accent"""
+
+    name = "gtts"
+
+    async def synthesize(self, text, voice):
+        return await asyncio.to_thread(self._synthesize, text, voice)
+
+    def _synthesize(self, text, voice):
+        from gtts import gTTS
+
+        lang, _, region = voice.partition("-")
+        tld = "co.in" if region.startswith("IN") else "com"
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang or "en", tld=tld).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+# MPEG-2 Layer III, 48 kbit/s, 24 kHz, mono: 144-byte frames of 24 ms each.
+# An all-zero side info block decodes as silence.
+_SILENT_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+_FRAME_SECONDS = 0.024
+
+
+class StubBackend:
+    """Offline stand-in producing silent MP3 audio roughly as long as the speech.
+
+    `latency` and `per_char` add an artificial delay per segment so the
+    pipeline can be benchmarked without network access.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.0, per_char=0.0, chars_per_second=15):
+        self.latency = latency
+        self.per_char = per_char
+        self.chars_per_second = chars_per_second
+
+    async def synthesize(self, text, voice):
+        delay = self.latency + self.per_char * len(text)
+        if delay:
+            await asyncio.sleep(delay)
+        frames = math.ceil(len(text) / self.chars_per_second / _FRAME_SECONDS)
+        return _SILENT_FRAME * max(frames, 1)
+
+
+def get_backend(name, stub_latency=0.0):
+    if name == "edge":
+        return EdgeTTSBackend()
+    if name == "gtts":
+        return GTTSBackend()
+    if name == "stub":
+        return StubBackend(latency=stub_latency)
+    raise ValueError(f"Unknown TTS backend: {name}")
+
+
+async def synthesize_segments(segments, voice, backend, concurrency=4):
+    """Yield (index, audio) in segment order while up to `concurrency` segments synthesize at once"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def synthesize(text):
+        async with semaphore:
+            return await backend.synthesize(text, voice)
+
+    tasks = [asyncio.ensure_future(synthesize(text)) for text in segments]
+    try:
+        for index, task in enumerate(tasks):
+            yield index, await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class AudioStream:
+    """Ordered MP3 segments shared between a synthesis job and its listeners.
+
+    The job appends segments as they are synthesized; any number of HTTP
+    responses can iterate from the beginning and block until more audio
+    arrives, so playback starts as soon as the first segment is ready.
+    """
+
+    def __init__(self):
+        self._segments = []
+        self._done = False
+        self._cond = threading.Condition()
+
+    @property
+    def ready_segments(self):
+        return len(self._segments)
+
+    def append(self, audio):
+        with self._cond:
+            self._segments.append(audio)
+            self._cond.notify_all()
+
+    def finish(self):
+        """Mark the stream complete (also called when synthesis fails part-way)"""
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._segments) and not self._done:
+                    self._cond.wait()
+                if index >= len(self._segments):
+                    return
+                audio = self._segments[index]
+            index += 1
+            yield audio
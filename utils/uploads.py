@@ -0,0 +1,47 @@
+import hashlib
+import os
+import re
+import uuid
+
+
+STORED_NAME_RE = re.compile(r"^([0-9a-f]{64})\.pdf$")
+
+
+def spool_upload(stream, folder, block_size=1024 * 1024):
+    """Copy an upload stream to a temporary file in `folder`, hashing it on the way.
+
+    Returns (sha256 hex digest, temporary path); pass the path to
+    `commit_upload` once the final name is known.
+    """
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    partial_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.part")
+    try:
+        with open(partial_path, "wb") as f:
+            for block in iter(lambda: stream.read(block_size), b""):
+                digest.update(block)
+                f.write(block)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return digest.hexdigest(), partial_path
+
+
+def stored_name(content_hash):
+    """Upload filename for a PDF with this content hash"""
+    return f"{content_hash}.pdf"
+
+
+def hash_from_name(filename):
+    """Content hash encoded in a stored upload name, or None for older uploads"""
+    match = STORED_NAME_RE.match(filename)
+    return match.group(1) if match else None
+
+
+def commit_upload(partial_path, path):
+    """Move a spooled upload into place; an identical file already there is kept"""
+    if os.path.exists(path):
+        os.remove(partial_path)
+    else:
+        os.replace(partial_path, path)